@@ -1,77 +1,339 @@
+import hashlib
+import os
+import signal
+import socket
 import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from redis import Redis
+from redis.exceptions import ResponseError
+from sqlalchemy import Integer, column, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from utils import database_models
-from utils.database import redis_client, sessionLocal
+from utils.database import redis_client, sessionLocal, engine
+from utils.migrations import run_migrations
+from utils.clicks import CLICK_STREAM_KEY, DIRTY_SET_KEY, CLICK_COUNTER_PREFIX
+from utils.analytics import GRANULARITIES, bucket_start, entry_time
 
-DIRTY_SET_KEY = "click_dirty_links"
+CONSUMER_GROUP = "click_flushers"
+# Unique per process so several workers can share the group
+CONSUMER_NAME = os.getenv("CLICK_WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
 
-def click_counter_key(link_id: int) -> str:
-    return f"click_count:{link_id}"
+MIN_BATCH_SIZE = int(os.getenv("CLICK_FLUSH_MIN_BATCH", "500"))
+# Two bind parameters per row; stays well below Postgres' 65535 limit
+MAX_BATCH_SIZE = int(os.getenv("CLICK_FLUSH_MAX_BATCH", "10000"))
+MIN_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_MIN_INTERVAL", "0.5"))
+MAX_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_MAX_INTERVAL", "5"))
+# Consumers silent for this long are presumed dead and their pending clicks reclaimed
+RECLAIM_IDLE_MS = int(os.getenv("CLICK_RECLAIM_IDLE_MS", "60000"))
 
-def flush_clicks_once(batch_size: int = 100):
+FLUSH_LOG_RETENTION = timedelta(days=1)
+# Rows per rollup INSERT; four bind parameters each
+ROLLUP_CHUNK_SIZE = 10000
+
+_stopping = False
+
+def apply_increments(db: Session, increments: dict[int, int]) -> None:
     """
-    Flush up to `batch_size` dirty links from Redis to Postgres.
+    Apply all click deltas with a single UPDATE ... FROM (VALUES ...) statement.
     """
-    # Get up to `batch_size` link IDs from dirty set
-    dirty_ids = redis_client.spop(DIRTY_SET_KEY, batch_size)  # returns single or list or None
+    deltas = values(
+        column("id", Integer), column("delta", Integer), name="deltas"
+    ).data(sorted(increments.items()))
+    db.execute(
+        update(database_models.Links)
+        .where(database_models.Links.id == deltas.c.id)
+        .values(clicks=database_models.Links.clicks + deltas.c.delta)
+        .execution_options(synchronize_session=False)
+    )
 
-    if not dirty_ids:
+def store_events(db: Session, events: list[tuple]) -> None:
+    """
+    Bulk-load raw click events with COPY and add them to the minute/hour/day rollups.
+    Each event is (link_id, clicked_at, referrer, ua_family, country).
+    """
+    # Links deleted since the click was recorded would violate the foreign keys
+    existing = set(db.scalars(select(database_models.Links.id).where(
+        database_models.Links.id.in_({e[0] for e in events}))))
+    events = [e for e in events if e[0] in existing]
+    if not events:
         return
 
-    # Normalize to list
-    if isinstance(dirty_ids, str):
-        dirty_ids = [dirty_ids]
+    rollups: Counter = Counter()
+    for link_id, clicked_at, *_ in events:
+        for granularity in GRANULARITIES:
+            rollups[(link_id, granularity, bucket_start(clicked_at, granularity))] += 1
+    # Sorted so concurrent workers lock rollup rows in the same order
+    rows = [
+        {"link_id": link_id, "granularity": granularity, "bucket_start": start, "clicks": clicks}
+        for (link_id, granularity, start), clicks in sorted(rollups.items())
+    ]
+    for i in range(0, len(rows), ROLLUP_CHUNK_SIZE):
+        stmt = insert(database_models.LinkClickRollups).values(rows[i:i + ROLLUP_CHUNK_SIZE])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["link_id", "granularity", "bucket_start"],
+            set_={"clicks": database_models.LinkClickRollups.clicks + stmt.excluded.clicks},
+        ))
+
+    raw = db.connection().connection.dbapi_connection
+    with raw.cursor() as cur:  # type: ignore
+        with cur.copy("COPY click_events (link_id, clicked_at, referrer, ua_family, country) FROM STDIN") as copy:
+            for event in events:
+                copy.write_row(event)
+
+def apply_batch(batch_id: str, increments: dict[int, int], events: list[tuple] | None = None) -> bool:
+    """
+    Apply a batch of click deltas, and the events they came from, exactly once.
+    Returns False if the batch had already been applied.
+    """
+    db: Session = sessionLocal()
+    try:
+        # The batch row goes first: a concurrent or repeated apply inserts nothing here.
+        # Any other integrity error propagates and the entries stay pending.
+        claimed = db.execute(
+            insert(database_models.ClickFlushBatches)
+            .values(id=batch_id, applied_at=datetime.now(timezone.utc))
+            .on_conflict_do_nothing()
+            .returning(database_models.ClickFlushBatches.id)).first()
+        if claimed is None:
+            db.rollback()
+            return False
+        apply_increments(db, increments)
+        if events:
+            store_events(db, events)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def next_interval(read: int) -> float:
+    """
+    Pause after a small batch so quiet periods coalesce into fewer, larger flushes.
+    """
+    if read >= MIN_BATCH_SIZE:
+        return 0.0
+    fill = read / MIN_BATCH_SIZE
+    return MAX_INTERVAL_SECONDS - (MAX_INTERVAL_SECONDS - MIN_INTERVAL_SECONDS) * fill
+
+def ensure_consumer_group() -> None:
+    try:
+        redis_client.xgroup_create(CLICK_STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def flush_entries(entries: list) -> int:
+    """
+    Apply a batch of click events, then acknowledge and drop them from the stream.
+    Returns the number of events handled.
+    """
+    if not entries:
+        return 0
+    entry_ids = [entry_id for entry_id, _ in entries]
+    events = [
+        (int(fields["link_id"]), entry_time(entry_id),
+         fields.get("referrer") or None, fields.get("ua") or None, fields.get("country") or None)
+        for entry_id, fields in entries if fields
+    ]
+    increments = Counter(event[0] for event in events)
+    # Derived from the entries so a reclaimed batch maps to the same flush log row
+    batch_id = hashlib.sha1(",".join(entry_ids).encode()).hexdigest()
+    if increments:
+        apply_batch(batch_id, dict(increments), events)
 
-    # Read counters and reset them
-    increments = {}
     pipe = redis_client.pipeline()
-    for id_str in dirty_ids:
-        pipe.get(click_counter_key(int(id_str)))
-    counts = pipe.execute()
+    pipe.xack(CLICK_STREAM_KEY, CONSUMER_GROUP, *entry_ids)
+    pipe.xdel(CLICK_STREAM_KEY, *entry_ids)
+    pipe.execute()
+    return len(entry_ids)
 
-    for id_str, val in zip(dirty_ids, counts):
-        if val is None:
-            continue
-        delta = int(val)
-        if delta <= 0:
+def flush_stream_once(block_ms: int) -> int:
+    """
+    Read up to MAX_BATCH_SIZE new click events for this consumer and flush them.
+    """
+    resp = redis_client.xreadgroup(CONSUMER_GROUP, CONSUMER_NAME, {CLICK_STREAM_KEY: ">"},
+                                   count=MAX_BATCH_SIZE, block=block_ms)
+    if not resp:
+        return 0
+    return flush_entries(resp[0][1])  # type: ignore
+
+def flush_own_pending() -> int:
+    """
+    Retry this consumer's unacknowledged batch, e.g. after Postgres was unavailable.
+    """
+    resp = redis_client.xreadgroup(CONSUMER_GROUP, CONSUMER_NAME, {CLICK_STREAM_KEY: "0"},
+                                   count=MAX_BATCH_SIZE)
+    if not resp:
+        return 0
+    return flush_entries(resp[0][1])  # type: ignore
+
+def reclaim_dead_consumers() -> int:
+    """
+    Take over click events left unacknowledged past RECLAIM_IDLE_MS, then drop dead consumers.
+    Each consumer holds at most one batch, so its entries are regrouped by their previous owner
+    and replay as the same batch.
+    """
+    owners: dict[str, str] = {}
+    dead = []
+    for consumer in redis_client.xinfo_consumers(CLICK_STREAM_KEY, CONSUMER_GROUP):  # type: ignore
+        name = consumer["name"]
+        if name == CONSUMER_NAME or consumer["idle"] < RECLAIM_IDLE_MS:
             continue
-        increments[int(id_str)] = delta
+        dead.append(name)
+        if consumer["pending"]:
+            pending = redis_client.xpending_range(CLICK_STREAM_KEY, CONSUMER_GROUP, min="-", max="+",
+                                                  count=MAX_BATCH_SIZE, consumername=name)
+            owners.update((p["message_id"], name) for p in pending)  # type: ignore
 
-    if not increments:
-        return
+    # XAUTOCLAIM only hands over entries that are still idle, so a peer reclaiming the same
+    # consumer gets nothing instead of entries we are applying. Entries trimmed from the stream
+    # are reported separately (and already dropped from the pending list); they are the only
+    # ones acknowledged without being claimed.
+    batches: dict[str, list] = {}
+    start = "0-0"
+    while True:
+        start, claimed, deleted = redis_client.xautoclaim(  # type: ignore
+            CLICK_STREAM_KEY, CONSUMER_GROUP, CONSUMER_NAME, RECLAIM_IDLE_MS,
+            start_id=start, count=MAX_BATCH_SIZE)
+        for entry_id, fields in claimed:
+            batches.setdefault(owners.get(entry_id, entry_id), []).append((entry_id, fields))
+        for entry_id in deleted:
+            batches.setdefault(owners.get(entry_id, entry_id), []).append((entry_id, None))
+        if start == "0-0":
+            break
+
+    reclaimed = 0
+    for entries in batches.values():
+        entries.sort(key=lambda entry: tuple(map(int, entry[0].split("-"))))
+        reclaimed += flush_entries(entries)
+    for name in dead:
+        # Deleting a consumer discards its pending entries, so only drop empty ones
+        if not redis_client.xpending_range(CLICK_STREAM_KEY, CONSUMER_GROUP, min="-", max="+",
+                                           count=1, consumername=name):
+            redis_client.xgroup_delconsumer(CLICK_STREAM_KEY, CONSUMER_GROUP, name)
+    return reclaimed
 
-    # Apply increments in DB
+# Counters written before clicks moved to the stream are drained once at startup.
+INFLIGHT_SET_KEY = "click_inflight_batches"
+
+def inflight_batch_key(batch_id: str) -> str:
+    return f"click_inflight:{batch_id}"
+
+# Atomically moves up to ARGV[1] dirty counters into an in-flight hash and resets them.
+# KEYS[1] = dirty set, KEYS[2] = in-flight batch set, KEYS[3] = in-flight hash,
+# ARGV[1] = batch size, ARGV[2] = batch id, ARGV[3] = counter key prefix
+SNAPSHOT_SCRIPT = """
+local ids = redis.call('SPOP', KEYS[1], ARGV[1])
+local out = {}
+for _, id in ipairs(ids) do
+    local count = redis.call('GETDEL', ARGV[3] .. id)
+    if count and tonumber(count) > 0 then
+        redis.call('HSET', KEYS[3], id, count)
+        table.insert(out, id)
+        table.insert(out, count)
+    end
+end
+if #out > 0 then
+    redis.call('SADD', KEYS[2], ARGV[2])
+end
+return out
+"""
+snapshot_script = redis_client.register_script(SNAPSHOT_SCRIPT)
+
+def release_inflight(batch_id: str) -> None:
+    pipe = redis_client.pipeline()
+    pipe.delete(inflight_batch_key(batch_id))
+    pipe.srem(INFLIGHT_SET_KEY, batch_id)
+    pipe.execute()
+
+def flush_clicks_once(batch_size: int = 100) -> int:
+    """
+    Flush up to `batch_size` legacy dirty counters from Redis to Postgres.
+    Returns the number of links updated.
+    """
+    batch_id = uuid.uuid4().hex
+    flat = snapshot_script(
+        keys=[DIRTY_SET_KEY, INFLIGHT_SET_KEY, inflight_batch_key(batch_id)],
+        args=[batch_size, batch_id, CLICK_COUNTER_PREFIX],
+    )
+    if not flat:
+        return 0
+
+    increments = {int(flat[i]): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+    # On failure the deltas stay in the in-flight hash and recover_inflight retries them
+    apply_batch(batch_id, increments)
+    release_inflight(batch_id)
+    return len(increments)
+
+def recover_inflight() -> int:
+    """
+    Finish legacy counter batches left in flight by a failed flush or a crashed worker.
+    Returns the number of batches recovered.
+    """
+    recovered = 0
+    for batch_id in redis_client.smembers(INFLIGHT_SET_KEY):  # type: ignore
+        deltas = redis_client.hgetall(inflight_batch_key(batch_id))
+        increments = {int(k): int(v) for k, v in deltas.items()}  # type: ignore
+        if increments:
+            apply_batch(batch_id, increments)
+        release_inflight(batch_id)
+        recovered += 1
+    return recovered
+
+def drain_legacy_counters() -> None:
+    recover_inflight()
+    while flush_clicks_once(batch_size=MAX_BATCH_SIZE):
+        pass
+
+def prune_flush_log() -> None:
     db: Session = sessionLocal()
     try:
-        for link_id, delta in increments.items():
-            db.query(database_models.Links).filter(
-                database_models.Links.id == link_id
-            ).update(
-                {database_models.Links.clicks: database_models.Links.clicks + delta},
-                synchronize_session=False,
-            )
+        db.query(database_models.ClickFlushBatches).filter(
+            database_models.ClickFlushBatches.applied_at < datetime.now(timezone.utc) - FLUSH_LOG_RETENTION
+        ).delete(synchronize_session=False)
         db.commit()
-    except Exception as e:
-        db.rollback()
-        # If something goes wrong, re-add these IDs back to the dirty set
-        for link_id in increments.keys():
-            redis_client.sadd(DIRTY_SET_KEY, link_id)
-        raise
     finally:
         db.close()
 
-    # Zero-out the counters after successful flush
-    pipe = redis_client.pipeline()
-    for link_id in increments.keys():
-        pipe.delete(click_counter_key(link_id))
-    pipe.execute()
+def request_stop(signum, frame) -> None:
+    global _stopping
+    _stopping = True
 
 def main_loop():
-    while True:
-        flush_clicks_once(batch_size=500)
-        time.sleep(5)  
+    ensure_consumer_group()
+    needs_recovery = True
+    last_maintenance = 0.0
+    block_ms = int(MAX_INTERVAL_SECONDS * 1000)
+    while not _stopping:
+        try:
+            if needs_recovery:
+                drain_legacy_counters()
+                flush_own_pending()
+                reclaim_dead_consumers()
+                needs_recovery = False
+            read = flush_stream_once(block_ms)
+            if time.monotonic() - last_maintenance > RECLAIM_IDLE_MS / 1000:
+                reclaim_dead_consumers()
+                prune_flush_log()
+                last_maintenance = time.monotonic()
+        except Exception:
+            # Postgres unavailable: unacknowledged events stay pending and are retried
+            needs_recovery = True
+            time.sleep(MAX_INTERVAL_SECONDS)
+            continue
+        time.sleep(next_interval(read) if read else 0)
+
+    # Only leave the group once nothing is pending, otherwise a peer reclaims it later
+    pending = redis_client.xpending_range(CLICK_STREAM_KEY, CONSUMER_GROUP, min="-", max="+",
+                                          count=1, consumername=CONSUMER_NAME)
+    if not pending:
+        redis_client.xgroup_delconsumer(CLICK_STREAM_KEY, CONSUMER_GROUP, CONSUMER_NAME)
 
 if __name__ == "__main__":
+    database_models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
     main_loop()
-
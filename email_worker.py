@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from utils.database import redis_client
+from utils.email_queue import EMAIL_QUEUE_KEY, EMAIL_RETRY_KEY, EMAIL_PROCESSING_PREFIX, EMAIL_ALIVE_PREFIX, deliver
+from utils.retries import PROMOTE_DUE_SCRIPT, retry_delay
+
+# Unique per process so workers sharing a container don't share a processing list
+WORKER_NAME = os.getenv("EMAIL_WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+PROCESSING_KEY = EMAIL_PROCESSING_PREFIX + WORKER_NAME
+ALIVE_KEY = EMAIL_ALIVE_PREFIX + WORKER_NAME
+ALIVE_TTL_SECONDS = 30
+
+SEND_THREADS = int(os.getenv("EMAIL_SEND_THREADS", "8"))
+# Messages taken from the queue per round
+BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 300.0
+# Per recipient; extra messages in the same hour are dropped
+RATE_LIMIT_PER_HOUR = int(os.getenv("EMAIL_RATE_LIMIT_PER_HOUR", "10"))
+
+logger = logging.getLogger("email_worker")
+promote_script = redis_client.register_script(PROMOTE_DUE_SCRIPT)
+
+_stopping = threading.Event()
+
+def request_stop(signum, frame):
+    _stopping.set()
+
+def rate_limited(to: str) -> bool:
+    hour = datetime.now(timezone.utc).strftime("%Y%m%d%H")
+    key = f"email_rate:{to.lower()}:{hour}"
+    pipe = redis_client.pipeline()
+    pipe.incr(key)
+    pipe.expire(key, 3600)
+    count, _ = pipe.execute()
+    return count > RATE_LIMIT_PER_HOUR
+
+def send(raw: str) -> None:
+    job = json.loads(raw)
+    if rate_limited(job["to"]):
+        logger.warning("Dropping %s email to %s: rate limit reached", job["template"], job["to"])
+        return
+    try:
+        deliver(job["to"], job["template"], job["params"])
+    except Exception:
+        job["attempts"] += 1
+        if job["attempts"] >= MAX_ATTEMPTS:
+            logger.exception("Giving up on %s email to %s", job["template"], job["to"])
+            return
+        retry_at = time.time() + retry_delay(job["attempts"], RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+        redis_client.zadd(EMAIL_RETRY_KEY, {json.dumps(job): retry_at})
+
+def take_batch() -> list[str]:
+    """
+    Up to BATCH_SIZE jobs, moved into our processing list until they are sent.
+    """
+    first = redis_client.blmove(EMAIL_QUEUE_KEY, PROCESSING_KEY, 1, "RIGHT", "LEFT")
+    if first is None:
+        return []
+    batch = [first]
+    while len(batch) < BATCH_SIZE:
+        raw = redis_client.lmove(EMAIL_QUEUE_KEY, PROCESSING_KEY, "RIGHT", "LEFT")
+        if raw is None:
+            break
+        batch.append(raw)
+    return batch # type: ignore
+
+def requeue_orphaned_jobs(include_own: bool = False) -> None:
+    """
+    Put back jobs held by workers whose heartbeat expired, e.g. a rescheduled container.
+    `include_own` also recovers what an earlier run under this worker name left behind.
+    """
+    for source in redis_client.scan_iter(f"{EMAIL_PROCESSING_PREFIX}*"):
+        owner = source[len(EMAIL_PROCESSING_PREFIX):]  # type: ignore
+        if owner == WORKER_NAME:
+            if not include_own:
+                continue
+        elif redis_client.exists(EMAIL_ALIVE_PREFIX + owner):
+            continue
+        while redis_client.lmove(source, EMAIL_QUEUE_KEY, "RIGHT", "RIGHT"):
+            pass
+
+def heartbeat() -> None:
+    # Own thread, so a slow batch of sends can't let our heartbeat lapse
+    while not _stopping.is_set():
+        try:
+            redis_client.set(ALIVE_KEY, 1, ex=ALIVE_TTL_SECONDS)
+            requeue_orphaned_jobs()
+        except Exception:
+            logger.exception("Heartbeat failed")
+        _stopping.wait(ALIVE_TTL_SECONDS / 3)
+
+def main_loop():
+    redis_client.set(ALIVE_KEY, 1, ex=ALIVE_TTL_SECONDS)
+    requeue_orphaned_jobs(include_own=True)
+    threading.Thread(target=heartbeat, name="email-heartbeat", daemon=True).start()
+
+    with ThreadPoolExecutor(max_workers=SEND_THREADS, thread_name_prefix="email") as pool:
+        while not _stopping.is_set():
+            promote_script(keys=[EMAIL_RETRY_KEY, EMAIL_QUEUE_KEY], args=[time.time(), BATCH_SIZE])
+            batch = take_batch()
+            if not batch:
+                continue
+            futures = {pool.submit(send, raw): raw for raw in batch}
+            wait(futures)
+            pipe = redis_client.pipeline(transaction=False)
+            for raw in batch:
+                pipe.lrem(PROCESSING_KEY, 1, raw)
+            pipe.execute()
+    redis_client.delete(ALIVE_KEY)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    main_loop()
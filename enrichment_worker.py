@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import time
+from sqlalchemy import update
+from utils import database_models
+from utils.database import async_redis_client, asyncSessionLocal, redis_client, sessionLocal, engine
+from utils.migrations import run_migrations
+from utils.enrichment import ENRICHMENT_QUEUE_KEY, ENRICHMENT_PROCESSING_PREFIX, ENRICHMENT_ALIVE_PREFIX, ENRICHMENT_RETRY_KEY
+from utils.retries import PROMOTE_DUE_SCRIPT, retry_delay
+from utils.titles import fetch_title
+from utils.qrcodes import ensure_link_qr, shutdown_qr_pool
+from security.safebrowsing import check_url_safety
+from router.links import API_URL, invalidate_link_keys, refresh_link_owners
+
+CONSUMER_NAME = os.getenv("ENRICHMENT_WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+CONCURRENCY = int(os.getenv("ENRICHMENT_CONCURRENCY", "16"))
+# Failed jobs are retried with backoff this many times, then the link is marked failed
+MAX_ATTEMPTS = int(os.getenv("ENRICHMENT_MAX_ATTEMPTS", "5"))
+# Retries wait about 10s, 20s, 40s, ... so an outage of the checks can pass first
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 600.0
+ALIVE_TTL_SECONDS = 30
+
+logger = logging.getLogger("enrichment_worker")
+promote_script = async_redis_client.register_script(PROMOTE_DUE_SCRIPT)
+
+_stop = asyncio.Event()
+
+def processing_key(slot: int) -> str:
+    return f"{ENRICHMENT_PROCESSING_PREFIX}{CONSUMER_NAME}:{slot}"
+
+async def link_title(link: database_models.Links) -> str:
+    return link.title or await fetch_title(link.original_url)
+
+async def enrich_link(link_id: int, generate_qr: bool) -> None:
+    async with asyncSessionLocal() as db:
+        link = await db.get(database_models.Links, link_id)
+        if link is None or link.status != database_models.LINK_PENDING:
+            return
+        key = link.short_code if link.short_code else link.alias
+
+        verdict, title = await asyncio.gather(check_url_safety(link.original_url), link_title(link))
+        link.title = title
+        if verdict != "safe":
+            link.status = database_models.LINK_BLOCKED
+        else:
+            if generate_qr:
+                await ensure_link_qr(link, f"http://{API_URL}{key}")
+            link.status = database_models.LINK_ACTIVE
+        # Users who didn't pick a title get the fetched one
+        await db.execute(update(database_models.userLinks).where(
+            database_models.userLinks.link_id == link_id,
+            database_models.userLinks.title == None).values(title=title))
+        await db.commit()
+
+    await asyncio.to_thread(publish_link_update, link_id, key)
+
+def publish_link_update(link_id: int, key: str) -> None:
+    # Cached entries still say pending; drop them everywhere and refresh the owners' lists
+    invalidate_link_keys(redis_client, key)
+    db = sessionLocal()
+    try:
+        refresh_link_owners(db, redis_client, link_id)
+    finally:
+        db.close()
+
+async def mark_failed(link_id: int) -> None:
+    async with asyncSessionLocal() as db:
+        link = await db.get(database_models.Links, link_id)
+        if link is None or link.status != database_models.LINK_PENDING:
+            return
+        key = link.short_code if link.short_code else link.alias
+        link.status = database_models.LINK_FAILED
+        await db.commit()
+    await asyncio.to_thread(publish_link_update, link_id, key)
+
+async def handle(raw: str) -> None:
+    job = json.loads(raw)
+    try:
+        await enrich_link(job["link_id"], job.get("generate_qr", False))
+    except Exception:
+        job["attempts"] = job.get("attempts", 0) + 1
+        if job["attempts"] < MAX_ATTEMPTS:
+            retry_at = time.time() + retry_delay(job["attempts"], RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+            await async_redis_client.zadd(ENRICHMENT_RETRY_KEY, {json.dumps(job): retry_at})
+        else:
+            logger.exception("Giving up on enriching link %s", job["link_id"])
+            await mark_failed(job["link_id"])
+
+async def run_slot(slot: int) -> None:
+    source = processing_key(slot)
+    while not _stop.is_set():
+        # The job stays in our processing list until it is done
+        raw = await async_redis_client.blmove(ENRICHMENT_QUEUE_KEY, source, 1, "RIGHT", "LEFT")
+        if raw is None:
+            continue
+        await handle(raw)
+        await async_redis_client.lrem(source, 1, raw)
+
+async def requeue_orphaned_jobs(include_own: bool = False) -> None:
+    """
+    Put back jobs held by workers whose heartbeat expired.
+    `include_own` also recovers what an earlier run under this worker name left behind.
+    """
+    async for source in async_redis_client.scan_iter(f"{ENRICHMENT_PROCESSING_PREFIX}*"):
+        owner = source[len(ENRICHMENT_PROCESSING_PREFIX):].rsplit(":", 1)[0]
+        if owner == CONSUMER_NAME:
+            if not include_own:
+                continue
+        elif await async_redis_client.exists(ENRICHMENT_ALIVE_PREFIX + owner):
+            continue
+        while await async_redis_client.lmove(source, ENRICHMENT_QUEUE_KEY, "RIGHT", "RIGHT"):
+            pass
+
+async def promote_retries() -> None:
+    while not _stop.is_set():
+        await promote_script(keys=[ENRICHMENT_RETRY_KEY, ENRICHMENT_QUEUE_KEY], args=[time.time(), CONCURRENCY])
+        try:
+            await asyncio.wait_for(_stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+async def heartbeat() -> None:
+    while not _stop.is_set():
+        await async_redis_client.set(ENRICHMENT_ALIVE_PREFIX + CONSUMER_NAME, 1, ex=ALIVE_TTL_SECONDS)
+        await requeue_orphaned_jobs()
+        try:
+            await asyncio.wait_for(_stop.wait(), ALIVE_TTL_SECONDS / 3)
+        except asyncio.TimeoutError:
+            pass
+
+async def main() -> None:
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, _stop.set)
+    loop.add_signal_handler(signal.SIGINT, _stop.set)
+    await requeue_orphaned_jobs(include_own=True)
+    # Slots finish their current job before exiting
+    await asyncio.gather(heartbeat(), promote_retries(), *(run_slot(i) for i in range(CONCURRENCY)))
+    await async_redis_client.delete(ENRICHMENT_ALIVE_PREFIX + CONSUMER_NAME)
+    shutdown_qr_pool()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    database_models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    asyncio.run(main())
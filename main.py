@@ -1,14 +1,41 @@
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import os
 #------------------------------------
 #python throws error if I don't inline models.py
 from fastapi import FastAPI
-from utils import database_models
-from utils.database import engine
+from utils import database_models, invalidation
+from utils.database import engine, async_engine, async_redis_client, async_binary_redis_client
+from utils.http import close_http_client
+from utils.migrations import run_migrations
+from utils.qrcodes import shutdown_qr_pool
 from router import auth, links, admin, users
+from security.safebrowsing import local_safe_browsing
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keeps in-process caches in sync with changes made by other workers
+    invalidation.start_listener()
+    tasks = []
+    if links.LINK_BLOOM_ENABLED:
+        tasks.append(asyncio.create_task(links.refresh_link_key_filter()))
+    if local_safe_browsing is not None:
+        tasks.append(asyncio.create_task(local_safe_browsing.refresh_forever()))
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    invalidation.stop_listener()
+    await close_http_client()
+    shutdown_qr_pool()
+    await async_redis_client.aclose()
+    await async_binary_redis_client.aclose()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware, 
     allow_origins = ["*"],
@@ -20,6 +47,7 @@ app.add_middleware(SessionMiddleware,
                    os.getenv("MIDDLEWARE_SECRET", "supersecretkey"))
 
 database_models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app.include_router(auth.router)
 app.include_router(links.router)
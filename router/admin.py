@@ -1,13 +1,18 @@
 from typing import Optional, Annotated
 from fastapi import APIRouter, Depends, Path, Query, HTTPException
 from sqlalchemy.exc import IntegrityError
-from utils.database import sessionLocal, engine
+from utils.database import sessionLocal, engine, Redis, get_redis
+from utils.hotcache import hot_links
+from utils.urls import url_hash
+from security.passwords import password_executor
+from security.principals import user_epochs
 from starlette import status
 from utils import database_models
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
-from .auth import get_current_user
-from .links import API_URL, fetch_title
+from .auth import get_current_user, verified_tokens
+from .links import API_URL, fetch_title, invalidate_link_keys, register_link_keys
+from .links import refresh_link_owners, remove_user_links, retry_failed_links
 
 from pydantic import BaseModel, Field, HttpUrl
 class Link(BaseModel):
@@ -63,6 +68,8 @@ def change_user_role(user: user_dependency, db: db_dependency, id: int, new_role
             raise HTTPException(status.HTTP_403_FORBIDDEN,"Cannot modify this user")
         db_user.role = new_role #type: ignore
         db.commit()
+        # Tokens still carry the old role; make the user sign in again
+        user_epochs.bump(db_user.id) #type: ignore
         return "User Updated"
     raise HTTPException(404,"User not found")
 
@@ -79,10 +86,23 @@ def delete_user(user: user_dependency, db: db_dependency, username: str):
     if db_user.id == 1: # type: ignore
         raise HTTPException(status.HTTP_403_FORBIDDEN,"Cannot delete this user")
     
+    user_id = db_user.id
     db.delete(db_user)
     db.commit()
+    user_epochs.bump(user_id) #type: ignore
     return "User Deleted"
     
+@router.get("/metrics")
+def get_metrics(user: user_dependency):
+    if user is None or user.get('role')!='admin':
+        raise HTTPException(401, detail='Authentication Failed.')
+
+    return {
+        "hot_link_cache": hot_links.stats(),
+        "password_hashing": password_executor.stats(),
+        "verified_tokens": verified_tokens.stats(),
+    }
+
 @router.get("/links")
 def get_all_links(user: user_dependency, db: db_dependency):
     if not user:
@@ -113,9 +133,23 @@ def get_link_by_key(user: user_dependency, db: db_dependency, key:str):
     #return key+": Link not found"
     raise HTTPException(404,key+": Link not found")
 
+@router.post("/links/retry-failed",status_code = status.HTTP_202_ACCEPTED)
+def retry_failed(user: user_dependency, db: db_dependency,
+                 key: Optional[str] = None, redis: Redis = Depends(get_redis)):
+    if user is None or user.get('role')!='admin':
+        raise HTTPException(401, detail='Authentication Failed.')
+
+    query = db.query(database_models.Links.id).filter(
+        database_models.Links.status == database_models.LINK_FAILED)
+    if key:
+        query = query.filter((database_models.Links.short_code == key) |
+                             (database_models.Links.alias == key))
+    link_ids = [link_id for (link_id,) in query]
+    return {"requeued": len(retry_failed_links(db, redis, *link_ids))}
+
 @router.put("/links/",status_code = status.HTTP_202_ACCEPTED)
 def update_link(user: user_dependency, db: db_dependency, 
-                   link:Link, key:str):
+                   link:Link, key:str, redis: Redis = Depends(get_redis)):
     if not user:
         raise HTTPException(401, detail='Authentication Failed.')
     
@@ -125,22 +159,28 @@ def update_link(user: user_dependency, db: db_dependency,
     if db_link:
         link_check = db.query(database_models.Links).filter(
             (database_models.Links.alias == link.alias)|(database_models.Links.short_code == link.alias)
-            |(database_models.Links.original_url == str(link.original_url)), 
+            |(database_models.Links.url_hash == url_hash(str(link.original_url))), 
             database_models.Links.id != db_link.id
             ).first()
         if link_check:
             raise HTTPException(409,detail="Another link with same alias or URL already exists.")
 
+        old_keys = (db_link.short_code, db_link.alias)
         db_link.title = link.title # type: ignore
         db_link.alias = link.alias # type: ignore
         db_link.original_url = str(link.original_url) # type: ignore
+        db_link.url_hash = url_hash(db_link.original_url) # type: ignore
         db.commit()
+        invalidate_link_keys(redis, *old_keys)
+        register_link_keys(redis, db_link.alias)
+        refresh_link_owners(db, redis, db_link.id)
         return "Link Updated"
     #return "Link not found"
     raise HTTPException(404,"Link not found")
 
 @router.delete("/{key}",status_code=status.HTTP_200_OK)
-def delete_link_by_key(user: user_dependency, key:str, db:Session = Depends(get_db)):
+def delete_link_by_key(user: user_dependency, key:str, db:Session = Depends(get_db),
+                       redis: Redis = Depends(get_redis)):
     if not user:
         raise HTTPException(401, detail='Authentication Failed.')
 
@@ -148,8 +188,14 @@ def delete_link_by_key(user: user_dependency, key:str, db:Session = Depends(get_
         (database_models.Links.short_code == key) |
         (database_models.Links.short_url == key)).first()
     if db_link:
+        owners = db.query(database_models.userLinks.user_id, database_models.userLinks.id).filter(
+            database_models.userLinks.link_id == db_link.id).all()
+        keys, created_at = (db_link.short_code, db_link.alias), db_link.created_at
         db.delete(db_link)
         db.commit()
+        invalidate_link_keys(redis, *keys)
+        for owner_id, user_link_id in owners:
+            remove_user_links(redis, owner_id, (created_at, user_link_id))
         return "Link deleted"
     #return "Link not found"
     raise HTTPException(404,"Link not found")
\ No newline at end of file
@@ -4,9 +4,8 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, Field, EmailStr
 from utils import database_models
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-from utils.database import sessionLocal, engine, Redis, get_redis
+from utils.database import sessionLocal, engine, Redis, get_redis, async_redis_client
 from starlette import status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from datetime import timedelta,datetime,timezone
@@ -14,10 +13,14 @@ from jose import jwt, JWTError
 from authlib.integrations.starlette_client import OAuth
 import os
 import random
+import time
 import hmac
 import hashlib
 import json
-from utils.AWShelper import send_email
+from utils.email_queue import enqueue_email
+from security.passwords import bcrypt_context, verify_password, hash_otp, verify_otp
+from security.principals import TOKEN_CACHE_SIZE, user_epochs
+from utils.hotcache import HotKeyCache
 
 class UserRequest(BaseModel):
 
@@ -67,7 +70,6 @@ class ChangePasswordRequest(BaseModel):
         pattern=r"^[0-9]{6}$",)
 
 
-bcrypt_context = CryptContext(schemes=['bcrypt'],deprecated = 'auto')
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
 SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key')
@@ -171,7 +173,7 @@ def create_verification_entry(
     extra: Optional[Dict[str, Any]] = None,
 ) -> None:
     payload: Dict[str, Any] = {
-        "code": bcrypt_context.hash(code),
+        "code": hash_otp(code, key),
         "attempts": 0,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
@@ -186,18 +188,18 @@ def verify_otp_code(email, otp, redis: Redis):
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No OTP code found. Please request a new code.")
     if verification["attempts"] >= MAX_ATTEMPTS:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Maximum verification attempts exceeded.")
-    if not bcrypt_context.verify(otp, verification["code"]):
+    if not verify_otp(otp, key, verification["code"]):
         _increment_attempts(redis, key, verification)
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid OTP code.")
     redis.delete(key)
 
 
-def authenticate_user(username: str, password: str, db:Session):
+async def authenticate_user(username: str, password: str, db:Session):
     user = db.query(database_models.Users).filter(
         (database_models.Users.username == username)|
         (database_models.Users.email == username)).first()
     if user:
-        if bcrypt_context.verify(password, user.hashed_password): # type: ignore
+        if await verify_password(password, user.hashed_password): # type: ignore
             return user
     return False
 
@@ -206,8 +208,11 @@ def hash_provider_id(provider: str, provider_id: str) -> str:
     return hmac.new(key=PROVIDER_SECRET_SALT.encode(), 
                     msg=msg, digestmod=hashlib.sha256).hexdigest()
 
+# Verified access tokens by sha256; entries never outlive the token's exp
+verified_tokens = HotKeyCache(TOKEN_CACHE_SIZE, ACCESS_EXPIRE_TIME * 60)
+
 def create_access_token(username: str, user_id: int, role:str, expires_delta: timedelta):
-    encode = {'sub':username, 'id':user_id, 'role':role}
+    encode = {'sub':username, 'id':user_id, 'role':role, 'epoch':user_epochs.current(user_id)}
     expires = datetime.now(timezone.utc) + expires_delta
     encode.update({'exp':expires})
     return jwt.encode(encode,SECRET_KEY,algorithm = ALGORITHM)
@@ -219,7 +224,26 @@ def create_pending_token(mode: str, provider: str, provider_id:str, email: str |
               'provider_id':provider_id, 'email':email, 'exp':expires}
     return jwt.encode(encode,SECRET_KEY,algorithm = ALGORITHM)
 
-def decode_user_from_token(token: str) -> dict:
+async def decode_user_from_token(token: str) -> dict:
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = verified_tokens.get(token_key)
+    if cached is None or cached[1] <= time.time():
+        cached = verify_access_token(token)
+        verified_tokens.set(token_key, cached)
+
+    principal, _, epoch = cached
+    # Role changes and deletions bump the epoch, revoking older tokens
+    if epoch < await user_epochs.current_async(principal["id"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate user."
+        )
+    return dict(principal)
+
+def verify_access_token(token: str) -> tuple[dict, float, int]:
+    """
+    Full JWT verification; returns the principal, its exp and its epoch.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get('sub')#type: ignore
@@ -232,7 +256,7 @@ def decode_user_from_token(token: str) -> dict:
                 detail="Could not validate user."
             )
 
-        return {"username": username, "id": user_id, "role": role}
+        return {"username": username, "id": user_id, "role": role}, payload['exp'], payload.get('epoch', 0)
 
     except JWTError:
         raise HTTPException(
@@ -247,7 +271,7 @@ def decode_pending_token(token: str) -> dict:
     return data
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
-    return decode_user_from_token(token)
+    return await decode_user_from_token(token)
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
@@ -432,7 +456,7 @@ async def bind_account(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     # 2. Verify password
-    if not authenticate_user(user.username, body.password, db):
+    if not await authenticate_user(user.username, body.password, db):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password")
 
     # 3. Ensure we haven't already linked this provider to someone else (paranoia)
@@ -473,12 +497,8 @@ async def get_otp_code(redis: Annotated[Redis, Depends(get_redis)], email: Email
     code = generate_numeric_code(6)
     create_verification_entry(redis, key, code)
 
-    #This requires AWS SES setup
-    send_email(
-        to=email,
-        subject="Your LinkBottle account's One Time Passcode",
-        body=f"Your One Time Passcode is: \n {code}",
-    )
+    # Sent by email_worker.py (AWS SES or SMTP)
+    await enqueue_email(async_redis_client, email, "otp", code=code)
     
     # Right now, also just return the code to frontend.
     return {"detail": "OTP code generated and sent.", "code": code}
@@ -512,7 +532,7 @@ def create_user(db:db_dependency, request: UserRequest, redis: Annotated[Redis,
 @router.post("/token", response_model = Token)
 async def login_for_access_token(formdata: Annotated[OAuth2PasswordRequestForm, Depends()],
                                  db: db_dependency):
-    user = authenticate_user(formdata.username, formdata.password, db)
+    user = await authenticate_user(formdata.username, formdata.password, db)
     if not user: 
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='Could not validate user.')
     token = create_access_token(user.username,user.id,user.role,timedelta(minutes=ACCESS_EXPIRE_TIME))#type: ignore
@@ -1,24 +1,42 @@
-from datetime import datetime,timezone
-import string, random
-from typing import Optional, Annotated, cast
-from fastapi import APIRouter, Depends, Path, Body, HTTPException, WebSocket, WebSocketDisconnect
+from datetime import datetime,timezone,timedelta
+from typing import Optional, Annotated, Literal, cast
+from fastapi import APIRouter, BackgroundTasks, Depends, Path, Body, Query, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import RedirectResponse, StreamingResponse, Response
 from sqlalchemy.exc import IntegrityError
-from utils.database import sessionLocal, engine, get_redis, Redis
+from utils.database import sessionLocal, engine, get_redis, Redis, redis_client, async_redis_client
+from utils.database import asyncSessionLocal, get_async_redis, AsyncRedis, async_binary_redis_client
 from starlette import status
 from utils import database_models
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import any_, desc, func, select, tuple_
 from .auth import get_current_user, decode_user_from_token
-from bs4 import BeautifulSoup
-import httpx
+import csv
 import json
 import base64
+import hashlib
+import tempfile
+import uuid
 import io
-from utils.AWShelper import generate_qr_code, upload_qr_to_s3
-from security.safebrowsing import check_url_with_google_safe_browsing, classify_url_with_openai
-
-from pydantic import BaseModel, HttpUrl, Field, constr
+import os
+import asyncio
+import anyio
+from utils.qrcodes import QR_MEDIA_TYPES, QR_SIZES, create_qr, ensure_link_qr, render_qr_bytes
+from utils.clicks import resolve_cached_click, record_click, LINK_MISSING
+from utils.bloom import RebuildableBloomFilter
+from utils.analytics import click_context, to_naive_utc
+from utils import user_link_index
+from utils.hotcache import HotKeyCache, hot_links
+from utils.shortcodes import make_allocator
+from utils.titles import fetch_title
+from utils import invalidation
+from utils.enrichment import ASYNC_LINK_ENRICHMENT, PENDING_RETRY_AFTER_SECONDS, enqueue_enrichment
+from security.safebrowsing import check_url_safety
+from utils.urls import url_hash
+from utils.imports import IMPORT_JOB_TTL_SECONDS, IMPORT_MAX_ERRORS, import_errors_key, import_format, import_job_key, iter_rows
+
+from pydantic import BaseModel, HttpUrl, Field, ValidationError, constr
 class LinkRequest(BaseModel):
     alias: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{3,30}$",
         description="Optional alias of 3–30 chars containing only letters, numbers, _ or -",)
@@ -52,8 +70,36 @@ API_URL = "localhost:8000/"
 
 CACHE_TTL_SECONDS = 300  # 5 minutes
 QR_CACHE_TTL_SECONDS = 3600  # 1 hour
-
-chars = string.ascii_letters + string.digits
+# Browsers and CDNs may keep QR images this long; they only change if the key is reused
+QR_HTTP_MAX_AGE_SECONDS = 86400
+# Rendered QR images per worker, keyed like their Redis entries
+qr_images = HotKeyCache(int(os.getenv("QR_IMAGE_CACHE_SIZE", "1000")), QR_CACHE_TTL_SECONDS)
+NEGATIVE_CACHE_TTL_SECONDS = 60
+
+# Default look-back window of /links/{key}/stats for each granularity
+STATS_DEFAULT_SPAN = {
+    "minute": timedelta(hours=1),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+}
+
+LINK_BLOOM_ENABLED = os.getenv("LINK_BLOOM_ENABLED", "false").lower() == "true"
+LINK_BLOOM_CAPACITY = int(os.getenv("LINK_BLOOM_CAPACITY", "1000000"))
+LINK_BLOOM_REBUILD_SECONDS = int(os.getenv("LINK_BLOOM_REBUILD_SECONDS", "3600"))
+
+# Items of one websocket batch upload created at the same time
+WS_BATCH_CONCURRENCY = int(os.getenv("WS_BATCH_CONCURRENCY", "8"))
+
+# POST /links/import limits; rows are validated and inserted this many at a time
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+IMPORT_SPOOL_MEMORY_BYTES = 1024 * 1024
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_ENRICH_CONCURRENCY = 16
+EXPORT_BATCH_SIZE = 1000
+
+# Hands out short codes without probing the links table
+short_codes = make_allocator(redis=redis_client)
+SHORT_CODE_ATTEMPTS = 5
 
 def link_to_dict(link: database_models.Links) -> dict:
     return {
@@ -66,10 +112,14 @@ def link_to_dict(link: database_models.Links) -> dict:
         "clicks": link.clicks,
         "created_at": link.created_at.isoformat() if link.created_at else None,
         "qr_code_path": link.qr_code_path,
+        "status": link.status,
     }
 
-def getString():
-     return ''.join(random.choice(chars) for _ in range(6))
+def link_cache_dict(link: database_models.Links) -> dict:
+    # Cached entries never carry the click count so redirects don't rewrite them
+    data = link_to_dict(link)
+    data.pop("clicks")
+    return data
 
 router = APIRouter(
     tags = ['links']
@@ -81,51 +131,587 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with asyncSessionLocal() as db:
+        yield db
     
 def links_user(user_id: int) -> str:
     return f"user:{user_id}:links"
 
+# Bumped on every change to the user's list; cached pages of older versions are never read again
+def links_user_version(user_id: int) -> str:
+    return f"{links_user(user_id)}:version"
+
+def links_user_page(user_id: int, version: int, params: dict) -> str:
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f"{links_user(user_id)}:v{version}:page:{digest}"
+
+def invalidate_user_links(redis: Redis, user_id: int) -> None:
+    redis.incr(links_user_version(user_id))
+
+def query_user_link_views(db: Session, user_id: int, link_ids: Optional[tuple] = None):
+    query = db.query(database_models.userLinks, database_models.Links).join(
+        database_models.Links, 
+        database_models.userLinks.link_id == database_models.Links.id,
+    ).filter(database_models.userLinks.user_id == user_id)
+    if link_ids is not None:
+        query = query.filter(database_models.userLinks.link_id.in_(link_ids))
+    return (user_link_view_dict(ul, link) for ul, link in query.yield_per(1000))
+
+def refresh_user_links(db: Session, redis: Redis, user_id: int, *link_ids: int) -> None:
+    """
+    Update the user's indexed list in place after links were added to it or changed.
+    """
+    # Bump first: a rebuild that read the old version then refuses to install its stale snapshot
+    invalidate_user_links(redis, user_id)
+    user_link_index.upsert_views(redis, user_id, query_user_link_views(db, user_id, link_ids))
+
+def refresh_link_owners(db: Session, redis: Redis, link_id: int) -> None:
+    # Link-level fields appear in the list of every user holding the link
+    owners = db.query(database_models.userLinks.user_id).filter(
+        database_models.userLinks.link_id == link_id).all()
+    for (owner_id,) in owners:
+        refresh_user_links(db, redis, owner_id, link_id)
+
+def remove_user_links(redis: Redis, user_id: int, *members: tuple[Optional[datetime], int]) -> None:
+    """
+    Drop entries from the user's indexed list; `members` are (link created_at, user_link_id) pairs.
+    """
+    # Bump first, as in refresh_user_links
+    invalidate_user_links(redis, user_id)
+    user_link_index.remove_views(redis, user_id, members)
+
 def link_key(key: str) -> str:
     return f"link:{key}"
 
 def link_qr_key(key: str) -> str:
     return f"link_qr:{key}"
 
-# Counter per link ID
-def click_counter_key(link_id: int) -> str:
-    return f"click_count:{link_id}"
+def link_missing_key(key: str) -> str:
+    return f"link_missing:{key}"
 
-# Set of link IDs that currently have pending deltas to flush
-DIRTY_SET_KEY = "click_dirty_links"
+# Every short_code and alias in use; answers most unknown keys without Redis or Postgres
+link_key_filter = RebuildableBloomFilter(LINK_BLOOM_CAPACITY)
+
+def rebuild_link_key_filter() -> None:
+    db = sessionLocal()
+    try:
+        expected = db.query(database_models.Links).count()
+        rows = db.query(database_models.Links.short_code, database_models.Links.alias).yield_per(10000)
+        link_key_filter.rebuild((k for row in rows for k in row if k), expected)
+    finally:
+        db.close()
+
+async def refresh_link_key_filter() -> None:
+    # Deleted keys are never removed from a Bloom filter, so rebuild it periodically
+    while True:
+        await asyncio.to_thread(rebuild_link_key_filter)
+        await asyncio.sleep(LINK_BLOOM_REBUILD_SECONDS)
+
+def register_link_keys(redis: Redis, *keys: Optional[str]) -> None:
+    """
+    Make newly created keys resolvable here and in every other worker.
+    """
+    live = [k for k in keys if k]
+    if not live:
+        return
+    redis.delete(*(link_missing_key(k) for k in live))
+    link_key_filter.add(*live)
+    invalidation.publish(redis, "link_keys_added", keys=live)
+
+def retry_failed_links(db: Session, redis: Redis, *link_ids: int) -> list[int]:
+    """
+    Put links whose enrichment gave up back to pending and queue them for another check.
+    Called when such a link's URL is submitted again. Returns the ids that were reset.
+    """
+    if not link_ids:
+        return []
+    failed = db.query(database_models.Links).filter(
+        database_models.Links.id.in_(set(link_ids)),
+        database_models.Links.status == database_models.LINK_FAILED).all()
+    if not failed:
+        return []
+    for db_link in failed:
+        db_link.status = database_models.LINK_PENDING
+    db.commit()
+    # Cached entries still say failed
+    invalidate_link_keys(redis, *(k for db_link in failed for k in (db_link.short_code, db_link.alias)))
+    pipe = redis.pipeline(transaction=False)
+    for db_link in failed:
+        enqueue_enrichment(pipe, db_link.id, False)
+    pipe.execute()
+    for db_link in failed:
+        refresh_link_owners(db, redis, db_link.id)
+    return [db_link.id for db_link in failed]
+
+def invalidate_link_keys(redis: Redis, *keys: Optional[str]) -> None:
+    """
+    Drop the cached entries for these keys here and in every other worker.
+    """
+    live = [k for k in keys if k]
+    if not live:
+        return
+    redis.delete(*(link_key(k) for k in live))
+    hot_links.invalidate(*live)
+    invalidation.publish(redis, "links", keys=live)
+
+invalidation.subscribe("links", lambda data: hot_links.invalidate(*data.get("keys", [])))
+invalidation.subscribe("link_keys_added", lambda data: link_key_filter.add(*data.get("keys", [])))
 
 db_dependency = Annotated[Session, Depends(get_db)]
+async_db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
 user_dependency = Annotated[dict,Depends(get_current_user)]
 
+LINKS_PAGE_DEFAULT = 50
+LINKS_PAGE_MAX = 200
+EPOCH = datetime(1970, 1, 1)
+
+def link_sort_column(sort: str):
+    if sort == "clicks":
+        return func.coalesce(database_models.Links.clicks, 0)
+    if sort == "title":
+        return func.coalesce(database_models.userLinks.title, database_models.Links.title, "")
+    return func.coalesce(database_models.Links.created_at, EPOCH)
+
+def encode_cursor(value, user_link_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, user_link_id]).encode()).decode()
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        value, user_link_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == "created_at":
+            value = datetime.fromisoformat(value)
+        return value, int(user_link_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, detail="Invalid cursor.")
+
+def read_indexed_links(db: Session, redis: Redis, user_id: int, limit: int,
+                       cursor: Optional[str], order: str) -> Optional[dict]:
+    """
+    Serve a created_at-ordered page from the user's Redis index, building it on first use.
+    Returns None if the index is unavailable, e.g. while another request builds it.
+    """
+    after = user_link_index.order_member(*decode_cursor(cursor, "created_at")) if cursor else None
+    page = user_link_index.read_page(redis, user_id, limit, after, order == "desc")
+    if page is None:
+        if not user_link_index.rebuild(redis, user_id, query_user_link_views(db, user_id),
+                                       links_user_version(user_id)):
+            return None
+        page = user_link_index.read_page(redis, user_id, limit, after, order == "desc")
+        if page is None:
+            return None
+
+    views, next_member = page
+    # Click counts change constantly, so they are read fresh rather than kept in the index
+    clicks = dict(db.query(database_models.Links.id, database_models.Links.clicks).filter(
+        database_models.Links.id.in_({view["id"] for view in views})).all())
+    for view in views:
+        view["clicks"] = clicks.get(view["id"], view["clicks"])
+    next_cursor = encode_cursor(*user_link_index.parse_member(next_member)) if next_member else None
+    return {"items": views, "next_cursor": next_cursor}
+
 @router.get("/links")
-def get_all_links(user: user_dependency, db: db_dependency, redis: Redis = Depends(get_redis)):
+def get_all_links(user: user_dependency, db: db_dependency, redis: Redis = Depends(get_redis),
+                  limit: int = Query(default=LINKS_PAGE_DEFAULT, ge=1, le=LINKS_PAGE_MAX),
+                  cursor: Optional[str] = None,
+                  sort: Literal["created_at", "clicks", "title"] = "created_at",
+                  order: Literal["asc", "desc"] = "desc",
+                  tag: Optional[str] = None):
     if not user:
         raise HTTPException(401, detail='Authentication Failed.')
     
     user_id = user.get('id')
     assert user_id is not None
-    cache_key = links_user(user_id)# 
-    cached_links = redis.get(cache_key)  
-    if cached_links:
-        return json.loads(cast(str, cached_links))
-
-    db_links = db.query(database_models.userLinks, database_models.Links).join(
+    if sort == "created_at" and not tag:
+        page = read_indexed_links(db, redis, user_id, limit, cursor, order)
+        if page is not None:
+            return page
+
+    params = {"limit": limit, "cursor": cursor, "sort": sort, "order": order, "tag": tag}
+    version = int(cast(str, redis.get(links_user_version(user_id))) or 0)
+    cache_key = links_user_page(user_id, version, params)
+    cached_page = redis.get(cache_key)  
+    if cached_page:
+        return json.loads(cast(str, cached_page))
+
+    sort_column = link_sort_column(sort)
+    query = db.query(database_models.userLinks, database_models.Links, sort_column).join(
         database_models.Links, 
         database_models.userLinks.link_id == database_models.Links.id,
-    ).filter(database_models.userLinks.user_id == user_id).all()
+    ).filter(database_models.userLinks.user_id == user_id)
+    if tag:
+        query = query.filter(any_(database_models.userLinks.tags) == tag)
+    if cursor:
+        # Keyset: continue strictly after the last row of the previous page
+        key = tuple_(sort_column, database_models.userLinks.id)
+        after = tuple_(*decode_cursor(cursor, sort))
+        query = query.filter(key < after if order == "desc" else key > after)
+    if order == "desc":
+        query = query.order_by(sort_column.desc(), database_models.userLinks.id.desc())
+    else:
+        query = query.order_by(sort_column, database_models.userLinks.id)
+    rows = query.limit(limit + 1).all()
     
-    data = [
-        user_link_view_dict(ul, link)
-        for (ul, link) in db_links
-    ]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_ul, _, last_value = rows[-1]
+        next_cursor = encode_cursor(last_value, last_ul.id)
+    data = {
+        "items": [user_link_view_dict(ul, link) for (ul, link, _) in rows],
+        "next_cursor": next_cursor,
+    }
     redis.set(cache_key, json.dumps(data), ex=CACHE_TTL_SECONDS)
 
     return data
 
+def qr_etag(image: bytes) -> str:
+    return '"' + hashlib.sha256(image).hexdigest()[:32] + '"'
+
+def link_qr_variant_key(key: str, fmt: str, size: Optional[int]) -> str:
+    # The natural-size PNG shares the entry written by GET /links/qrcode/
+    if fmt == "png" and size is None:
+        return link_qr_key(key)
+    return f"{link_qr_key(key)}:{fmt}:{size or ''}"
+
+async def serve_link_qr(request: Request, db: AsyncSession, redis: AsyncRedis, key: str,
+                        fmt: str, size: Optional[int]) -> Response:
+    if size is not None and size not in QR_SIZES:
+        raise HTTPException(400, detail=f"size must be one of {', '.join(map(str, QR_SIZES))}.")
+    data = await get_link_by_key(db, redis, key)
+    if data.get('status') in (database_models.LINK_BLOCKED, database_models.LINK_FAILED):
+        raise link_unavailable(data['status'])
+
+    cache_key = link_qr_variant_key(key, fmt, size)
+    cached = qr_images.get(cache_key)
+    if cached is None:
+        image = await async_binary_redis_client.get(cache_key)
+        if image is None:
+            image = await render_qr_bytes(f"http://{API_URL}{key}", fmt, size)
+            await async_binary_redis_client.set(cache_key, image, ex=QR_CACHE_TTL_SECONDS)
+        cached = (qr_etag(image), image)
+        qr_images.set(cache_key, cached)
+
+    etag, image = cached
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={QR_HTTP_MAX_AGE_SECONDS}"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=image, media_type=QR_MEDIA_TYPES[fmt], headers=headers)
+
+@router.get("/links/{key}/qr.png")
+async def get_link_qr_png(request: Request, db: async_db_dependency, key: str,
+                          size: Optional[int] = None, redis: AsyncRedis = Depends(get_async_redis)):
+    return await serve_link_qr(request, db, redis, key, "png", size)
+
+@router.get("/links/{key}/qr.svg")
+async def get_link_qr_svg(request: Request, db: async_db_dependency, key: str,
+                          redis: AsyncRedis = Depends(get_async_redis)):
+    return await serve_link_qr(request, db, redis, key, "svg", None)
+
+EXPORT_FIELDS = ("short_url", "short_code", "alias", "original_url", "title", "tags", "clicks",
+                 "created_at", "status")
+
+def export_row(ul: database_models.userLinks, link: database_models.Links) -> dict:
+    return {
+        "short_url": link.short_url,
+        "short_code": link.short_code,
+        "alias": link.alias,
+        "original_url": link.original_url,
+        "title": ul.title or link.title,
+        "tags": ul.tags or [],
+        "clicks": link.clicks,
+        "created_at": link.created_at.isoformat() if link.created_at else None,
+        "status": link.status,
+    }
+
+def iter_export(user_id: int, fmt: str, tag: Optional[str],
+                start: Optional[datetime], end: Optional[datetime]):
+    # Runs in Starlette's threadpool while the response streams; the request's session may
+    # already be closed by then, so the export uses its own
+    db = sessionLocal()
+    try:
+        query = select(database_models.userLinks, database_models.Links).join(
+            database_models.Links,
+            database_models.userLinks.link_id == database_models.Links.id,
+        ).filter(database_models.userLinks.user_id == user_id)
+        if tag:
+            query = query.filter(any_(database_models.userLinks.tags) == tag)
+        if start:
+            query = query.filter(database_models.Links.created_at >= to_naive_utc(start))
+        if end:
+            query = query.filter(database_models.Links.created_at < to_naive_utc(end))
+        query = query.order_by(database_models.Links.created_at, database_models.userLinks.id)
+        # Server-side cursor: rows arrive EXPORT_BATCH_SIZE at a time, never all at once
+        rows = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        if fmt == "csv":
+            writer.writeheader()
+        for partition in rows.partitions():
+            for ul, link in partition:
+                row = export_row(ul, link)
+                if fmt == "csv":
+                    row["tags"] = ";".join(row["tags"])
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(row) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # An empty export still gets its CSV header
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+@router.get("/links/export")
+def export_links(user: user_dependency, format: Literal["csv", "ndjson"] = "csv",
+                 tag: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None):
+    if not user:
+        raise HTTPException(401, detail='Authentication Failed.')
+    user_id = user.get('id')
+    assert user_id is not None
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        iter_export(user_id, format, tag, start, end),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="links.{format}"'},
+    )
+
+@router.post("/links/import", status_code=status.HTTP_202_ACCEPTED)
+async def import_links(user: user_dependency, request: Request, background_tasks: BackgroundTasks,
+                       format: Optional[Literal["csv", "ndjson"]] = None,
+                       redis: AsyncRedis = Depends(get_async_redis)):
+    if not user:
+        raise HTTPException(401, detail='Authentication Failed.')
+    fmt = import_format(format, request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(415, detail="Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson.")
+
+    # The body is only spooled here; parsing and inserts happen in the background job
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                raise HTTPException(413, detail=f"Imports are limited to {IMPORT_MAX_BYTES} bytes.")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+
+    job_id = uuid.uuid4().hex
+    job_key = import_job_key(job_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(job_key, mapping={"status": "queued", "user_id": user['id'], "format": fmt,
+                                "rows": 0, "created": 0, "linked": 0, "skipped": 0, "failed": 0})
+    pipe.expire(job_key, IMPORT_JOB_TTL_SECONDS)
+    await pipe.execute()
+    background_tasks.add_task(run_import, job_id, user, spool, fmt)
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/links/import/{job_id}")
+async def get_import_job(user: user_dependency, job_id: str, redis: AsyncRedis = Depends(get_async_redis)):
+    if not user:
+        raise HTTPException(401, detail='Authentication Failed.')
+    job = await redis.hgetall(import_job_key(job_id))
+    if not job or job.get("user_id") != str(user.get('id')):
+        raise HTTPException(404, "Import job not found")
+    errors = await redis.lrange(import_errors_key(job_id), 0, -1)
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "format": job["format"],
+        **{field: int(job[field]) for field in ("rows", "created", "linked", "skipped", "failed")},
+        "errors": [json.loads(e) for e in errors],
+        **({"detail": job["detail"]} if "detail" in job else {}),
+    }
+
+def validation_message(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in exc.errors())
+
+async def run_import(job_id: str, user: dict, spool, fmt: str) -> None:
+    job_key = import_job_key(job_id)
+    await async_redis_client.hset(job_key, "status", "running")
+    try:
+        rows: list[tuple[int, LinkRequest]] = []
+        errors: list[tuple[int, int, str]] = []
+        for line_no, row, error in iter_rows(spool, fmt):
+            if row is not None:
+                try:
+                    rows.append((line_no, LinkRequest(**row)))
+                except ValidationError as e:
+                    errors.append((line_no, 422, validation_message(e)))
+            else:
+                errors.append((line_no, 422, cast(str, error)))
+            if len(rows) + len(errors) >= IMPORT_CHUNK_SIZE:
+                await import_chunk(job_id, user['id'], rows, errors)
+                rows, errors = [], []
+        await import_chunk(job_id, user['id'], rows, errors)
+        await async_redis_client.hset(job_key, "status", "done")
+    except Exception as e:
+        await async_redis_client.hset(job_key, mapping={"status": "failed", "detail": str(e)})
+    finally:
+        spool.close()
+
+async def import_chunk(job_id: str, user_id: int, rows: list[tuple[int, LinkRequest]],
+                       errors: list[tuple[int, int, str]]) -> None:
+    counts = {"rows": len(rows) + len(errors), "created": 0, "linked": 0, "skipped": 0}
+    if rows:
+        db = sessionLocal()
+        try:
+            new_rows, linked, skipped = await asyncio.to_thread(plan_import_chunk, db, user_id, rows, errors)
+            if new_rows and not ASYNC_LINK_ENRICHMENT:
+                new_rows = await enrich_import_rows(new_rows, errors)
+            created = await asyncio.to_thread(insert_import_chunk, db, user_id, new_rows, linked, errors)
+        finally:
+            db.close()
+        counts.update(created=len(created), linked=len(linked), skipped=skipped)
+
+    job_key = import_job_key(job_id)
+    pipe = async_redis_client.pipeline(transaction=False)
+    for field, value in counts.items():
+        pipe.hincrby(job_key, field, value)
+    pipe.hincrby(job_key, "failed", len(errors))
+    if errors:
+        errors.sort()
+        pipe.rpush(import_errors_key(job_id),
+                   *(json.dumps({"line": line, "code": code, "detail": detail}) for line, code, detail in errors))
+        pipe.ltrim(import_errors_key(job_id), 0, IMPORT_MAX_ERRORS - 1)
+        pipe.expire(import_errors_key(job_id), IMPORT_JOB_TTL_SECONDS)
+    await pipe.execute()
+
+def plan_import_chunk(db: Session, user_id: int, rows: list[tuple[int, LinkRequest]],
+                      errors: list[tuple[int, int, str]]):
+    """
+    Sort rows into new links, rows linking the user to an existing link, and rows the
+    user already has, with a couple of bulk queries instead of lookups per row.
+    """
+    hashes = {line_no: url_hash(str(link.original_url)) for line_no, link in rows}
+    aliases = {link.alias for _, link in rows if link.alias}
+    existing = db.query(database_models.Links).filter(
+        database_models.Links.url_hash.in_(set(hashes.values()))
+        | database_models.Links.alias.in_(aliases)
+        | database_models.Links.short_code.in_(aliases)).all()
+    by_hash: dict[str, list[database_models.Links]] = {}
+    by_key: dict[str, database_models.Links] = {}
+    for db_link in existing:
+        by_hash.setdefault(db_link.url_hash, []).append(db_link)
+        for key in (db_link.short_code, db_link.alias):
+            if key:
+                by_key[key] = db_link
+    owned = {link_id for (link_id,) in db.query(database_models.userLinks.link_id).filter(
+        database_models.userLinks.user_id == user_id,
+        database_models.userLinks.link_id.in_([l.id for l in existing]))}
+
+    new_rows: list[tuple[int, LinkRequest, str]] = []
+    linked: list[tuple[int, str, Optional[str]]] = []
+    new_keys: set[str] = set()
+    new_hashes: set[str] = set()
+    # Existing links of these URLs whose enrichment gave up get another try
+    submitted = set(hashes.values())
+    retry = {l.id for l in existing if l.url_hash in submitted and l.status == database_models.LINK_FAILED}
+    skipped = 0
+    for line_no, link in rows:
+        h = hashes[line_no]
+        if any(l.id in owned for l in by_hash.get(h, [])) or (not link.alias and h in new_hashes):
+            skipped += 1  # User already has this link
+            continue
+        if link.alias:
+            hit = by_key.get(link.alias)
+            if (hit is not None and hit.url_hash != h) or (hit is None and link.alias in new_keys):
+                errors.append((line_no, 409, "A different Link already uses this alias."))
+                continue
+        else:
+            hit = next((l for l in by_hash.get(h, []) if l.short_code), None)
+        if hit is not None:
+            #same link already exists for different user, just link it to this user
+            owned.add(hit.id)
+            linked.append((hit.id, link.alias or hit.short_code, link.title or hit.title))
+            continue
+        if link.alias:
+            new_keys.add(link.alias)
+        new_hashes.add(h)
+        new_rows.append((line_no, link, h))
+    retry_failed_links(db, redis_client, *retry)
+    # Hand the connection back before the chunk's network checks run
+    db.rollback()
+    return new_rows, linked, skipped
+
+async def enrich_import_rows(new_rows: list[tuple[int, LinkRequest, str]],
+                             errors: list[tuple[int, int, str]]):
+    """
+    The inline safety check and title fetch, run for many rows at once.
+    Concurrent lookups share Safe Browsing requests through the batcher.
+    """
+    limit = asyncio.Semaphore(IMPORT_ENRICH_CONCURRENCY)
+
+    async def enrich(line_no: int, link: LinkRequest):
+        async with limit:
+            try:
+                await link_safety_check(str(link.original_url))
+            except HTTPException as e:
+                errors.append((line_no, e.status_code, cast(str, e.detail)))
+                return None
+            except Exception:
+                errors.append((line_no, 502, "Could not check the URL, try again later."))
+                return None
+            if link.title is None:
+                link.title = await fetch_title(str(link.original_url))
+            return link
+
+    results = await asyncio.gather(*(enrich(line_no, link) for line_no, link, _ in new_rows))
+    return [row for row, ok in zip(new_rows, results) if ok is not None]
+
+def insert_import_chunk(db: Session, user_id: int, new_rows: list[tuple[int, LinkRequest, str]],
+                        linked: list, errors: list[tuple[int, int, str]]) -> list[int]:
+    """
+    Multi-row INSERTs for the chunk's links and user links, committed once.
+    """
+    timestamp = datetime.now(timezone.utc)
+    link_status = database_models.LINK_PENDING if ASYNC_LINK_ENRICHMENT else database_models.LINK_ACTIVE
+    pending = {}
+    for line_no, link, h in new_rows:
+        pending[link.alias or short_codes.allocate(db)] = (line_no, link, h)
+    created = []
+    if pending:
+        inserted = db.execute(pg_insert(database_models.Links).values([{
+            "original_url": str(link.original_url), "url_hash": h, "title": link.title,
+            "short_code": None if link.alias else key, "alias": link.alias,
+            "short_url": API_URL + key, "created_at": timestamp, "clicks": 0, "status": link_status,
+        } for key, (_, link, h) in pending.items()]).on_conflict_do_nothing().returning(
+            database_models.Links.id, database_models.Links.short_code, database_models.Links.alias)).all()
+        created = [(row.id, row.alias or row.short_code) for row in inserted]
+        for key in pending.keys() - {key for _, key in created}:
+            # Lost a race for the alias, or a code hit one from the old random scheme
+            errors.append((pending[key][0], 409, "The short code or alias is already taken."))
+
+    user_links = [{"user_id": user_id, "link_id": link_id, "key": key, "title": pending[key][1].title}
+                  for link_id, key in created]
+    user_links += [{"user_id": user_id, "link_id": link_id, "key": key, "title": title}
+                   for link_id, key, title in linked]
+    if user_links:
+        db.execute(pg_insert(database_models.userLinks).values(user_links))
+    db.commit()
+
+    # One round of cache updates for the whole chunk
+    if created:
+        register_link_keys(redis_client, *(key for _, key in created))
+        if ASYNC_LINK_ENRICHMENT:
+            pipe = redis_client.pipeline(transaction=False)
+            for link_id, key in created:
+                enqueue_enrichment(pipe, link_id, bool(pending[key][1].generate_qr))
+            pipe.execute()
+    if user_links:
+        refresh_user_links(db, redis_client, user_id, *(ul["link_id"] for ul in user_links))
+    return [link_id for link_id, _ in created]
+
 @router.get("/links/qrcode/")
 def get_link_qrcode(user: user_dependency, db: db_dependency, key:str, redis: Redis = Depends(get_redis)):
     if not user:
@@ -138,44 +724,167 @@ def get_link_qrcode(user: user_dependency, db: db_dependency, key:str, redis: Re
         (database_models.Links.alias == key)).first()
     if not db_link: 
         raise HTTPException(404,"Link not found")
-    
-    qr_code_img = generate_qr_code(f"http://{API_URL}{key}")
-    qr_s3_url = upload_qr_to_s3(key, qr_code_img.getvalue())
-    db_link.qr_code_path = qr_s3_url
+    # Sync handler running in the threadpool; rendering and upload run on the loop's pools
+    png = anyio.from_thread.run(ensure_link_qr, db_link, f"http://{API_URL}{key}")
+    if png is None:
+        return {'qr_code_path': db_link.qr_code_path}
     db.commit()
 
-    redis.set(link_qr_key(key), qr_code_img.getvalue(), ex=QR_CACHE_TTL_SECONDS)
-    redis.delete(links_user(user.get('id'))) #type: ignore
-    return {'qr_code_path': qr_s3_url}
+    redis.set(link_qr_key(key), png, ex=QR_CACHE_TTL_SECONDS)
+    refresh_link_owners(db, redis, db_link.id)
+    return {'qr_code_path': db_link.qr_code_path}
     
+def get_user_link_id(db: Session, user_id: int, key: str) -> int:
+    user_link = db.query(database_models.userLinks.link_id).filter(
+        database_models.userLinks.key == key,
+        database_models.userLinks.user_id == user_id).first()
+    if not user_link:
+        raise HTTPException(404,"Link not found for this user")
+    return user_link.link_id
+
+def stats_range(granularity: str, start: Optional[datetime], end: Optional[datetime]) -> tuple[datetime, datetime]:
+    end = to_naive_utc(end) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+    start = to_naive_utc(start) if start else end - STATS_DEFAULT_SPAN[granularity]
+    if start >= end:
+        raise HTTPException(400, detail="start must be before end.")
+    return start, end
+
+@router.get("/links/{key}/stats")
+def get_link_stats(user: user_dependency, db: db_dependency, key: str,
+                   granularity: Literal["minute", "hour", "day"] = "hour",
+                   start: Optional[datetime] = None, end: Optional[datetime] = None):
+    if not user:
+        raise HTTPException(401, detail='Authentication Failed.')
+
+    link_id = get_user_link_id(db, user.get('id'), key) #type: ignore
+    start, end = stats_range(granularity, start, end)
+    rollups = database_models.LinkClickRollups
+    rows = db.query(rollups.bucket_start, rollups.clicks).filter(
+        rollups.link_id == link_id,
+        rollups.granularity == granularity,
+        rollups.bucket_start >= start,
+        rollups.bucket_start < end,
+    ).order_by(rollups.bucket_start).all()
+
+    return {
+        "key": key,
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total": sum(clicks for _, clicks in rows),
+        "buckets": [{"start": bucket.isoformat(), "clicks": clicks} for bucket, clicks in rows],
+    }
+
+@router.get("/links/{key}/stats/breakdown")
+def get_link_stats_breakdown(user: user_dependency, db: db_dependency, key: str,
+                             dimension: Literal["referrer", "ua_family", "country"] = "referrer",
+                             start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             limit: int = Query(default=20, ge=1, le=100)):
+    if not user:
+        raise HTTPException(401, detail='Authentication Failed.')
+
+    link_id = get_user_link_id(db, user.get('id'), key) #type: ignore
+    start, end = stats_range("day", start, end)
+    events = database_models.ClickEvents
+    column = getattr(events, dimension)
+    clicks = func.count().label("clicks")
+    rows = db.query(column, clicks).filter(
+        events.link_id == link_id,
+        events.clicked_at >= start,
+        events.clicked_at < end,
+    ).group_by(column).order_by(desc(clicks)).limit(limit).all()
+
+    return {
+        "key": key,
+        "dimension": dimension,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "values": [{"value": value, "clicks": count} for value, count in rows],
+    }
+
 #ShortToLong. This endpoint is the last one to avoid conflict with other /links/ endpoints
 @router.get("/{key}")
-def go_to_link( db: db_dependency, key:str, redis: Redis = Depends(get_redis)):
+async def go_to_link(db: async_db_dependency, key:str, request: Request,
+                     redis: AsyncRedis = Depends(get_async_redis)):
+
+    context = click_context(request.headers)
+    return RedirectResponse(url=await resolve_and_count_click(db, redis, key, context))
+
+async def resolve_and_count_click(db: AsyncSession, redis: AsyncRedis, key: str,
+                                  context: dict[str, str]) -> str:
+    # Hottest path: resolved in-process, only the click goes to Redis
+    hot = hot_links.get(key)
+    if hot is not None:
+        link_id, original_url = hot
+        pipe = redis.pipeline(transaction=False)
+        record_click(pipe, link_id, context)
+        await pipe.execute()
+        return original_url
+
+    if LINK_BLOOM_ENABLED and not link_key_filter.might_contain(key):
+        raise HTTPException(404,"Link not found")
 
-    data = get_link_by_key(db, redis, key, update_clicks=True)
-    return RedirectResponse(url=data['original_url'])
+    # Fast path: resolve and count in a single Redis round trip
+    cached = await resolve_cached_click(redis, link_key(key), link_missing_key(key), context)
+    if cached == LINK_MISSING:
+        raise HTTPException(404,"Link not found")
+    if isinstance(cached, str):
+        raise link_unavailable(cached)
+    if cached is not None:
+        hot_links.set(key, cached)
+        return cached[1]
+
+    try:
+        data = await fetch_link_by_key(db, key)
+    except HTTPException:
+        await redis.set(link_missing_key(key), 1, ex=NEGATIVE_CACHE_TTL_SECONDS)
+        raise
+    if data.get('status', database_models.LINK_ACTIVE) != database_models.LINK_ACTIVE:
+        await redis.set(link_key(key), json.dumps(data), ex=CACHE_TTL_SECONDS)
+        raise link_unavailable(data['status'])
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(link_key(key), json.dumps(data), ex=CACHE_TTL_SECONDS)
+    record_click(pipe, data['id'], context)
+    await pipe.execute()
+    hot_links.set(key, (data['id'], data['original_url']))
+    return data['original_url']
+
+def link_unavailable(link_status: str) -> HTTPException:
+    # Pending links are held until enrichment_worker has a safety verdict
+    if link_status == database_models.LINK_PENDING:
+        return HTTPException(503, detail="Link is still being checked.",
+                             headers={"Retry-After": str(PENDING_RETRY_AFTER_SECONDS)})
+    if link_status == database_models.LINK_FAILED:
+        return HTTPException(403, detail="The link could not be checked for safety.")
+    return HTTPException(403, detail="The link was flagged as unsafe.")
+
+async def fetch_link_by_key(db: AsyncSession, key: str) -> dict:
+    result = await db.execute(select(database_models.Links).filter(
+        (database_models.Links.short_code == key)|
+        (database_models.Links.alias == key)).limit(1))
+    db_link = result.scalars().first()
+    if not db_link: 
+        raise HTTPException(404,"Link not found")
+    return link_cache_dict(db_link)
+
+async def get_link_by_key(db: AsyncSession, redis: AsyncRedis, key: str):
+    # Unknown keys are turned away like in resolve_and_count_click, before they reach Postgres
+    if LINK_BLOOM_ENABLED and not link_key_filter.might_contain(key):
+        raise HTTPException(404,"Link not found")
 
-def get_link_by_key(db, redis, key: str, update_clicks: bool = False):
     cache_key = link_key(key) 
-    cached_link =  redis.get(cache_key)
+    cached_link, missing = await redis.mget(cache_key, link_missing_key(key))
     if cached_link:
-        data = json.loads(cast(str, cached_link))
-    else:
-    
-        db_link = db.query(database_models.Links).filter(
-            (database_models.Links.short_code == key)|
-            (database_models.Links.alias == key)).first()
-        if not db_link: 
-            raise HTTPException(404,"Link not found")
-
-        data = link_to_dict(db_link)
-        redis.set(cache_key, json.dumps(data), ex=CACHE_TTL_SECONDS)
-    if update_clicks:
-        data['clicks'] += 1
-        redis.set(cache_key, json.dumps(data), ex=CACHE_TTL_SECONDS) 
-        redis.incr(click_counter_key(data['id']))  
-        redis.sadd(DIRTY_SET_KEY, data['id'])
+        return json.loads(cast(str, cached_link))
+    if missing:
+        raise HTTPException(404,"Link not found")
 
+    try:
+        data = await fetch_link_by_key(db, key)
+    except HTTPException:
+        await redis.set(link_missing_key(key), 1, ex=NEGATIVE_CACHE_TTL_SECONDS)
+        raise
+    await redis.set(cache_key, json.dumps(data), ex=CACHE_TTL_SECONDS)
     return data
 
 #LongToShort
@@ -188,27 +897,53 @@ async def shorten_link(user: user_dependency, db: db_dependency, link: LinkReque
 
     data = link_to_dict(link_model)
 
-    # Invalidate user's list
+    # Update user's list
     user_id = user.get('id')
     assert user_id is not None
-    redis.delete(links_user(user_id))
+    refresh_user_links(db, redis, user_id, link_model.id)
     # Populate single-link cache
-    redis.set(link_key(link_model.short_code if link_model.short_code else link_model.alias 
-                             ), json.dumps(data), ex=CACHE_TTL_SECONDS) #  
+    key = link_model.short_code if link_model.short_code else link_model.alias
+    register_link_keys(redis, key)
+    redis.set(link_key(key), json.dumps(link_cache_dict(link_model)), ex=CACHE_TTL_SECONDS) #  
 
     return data
 
 async def link_safety_check(url: str):
-    threat = await check_url_with_google_safe_browsing(url)
-    if threat:
+    verdict = await check_url_safety(url)
+    if verdict == "threat":
         raise HTTPException(400, detail="The provided URL is flagged as unsafe.")
-    
-    classify = await classify_url_with_openai(url)
-    category = classify["category"]
-
-    if category in ("spam", "scam_or_phishing", "extremely_high_risk"):
+    if verdict == "spam":
         raise HTTPException(400, detail="The provided URL is flagged as spam or unsafe.")
 
+async def enrich_new_link(long_url: str, link: LinkRequest) -> Optional[str]:
+    """
+    Safety check and title for a new link; deferred to enrichment_worker in async mode.
+    """
+    if ASYNC_LINK_ENRICHMENT:
+        return link.title
+    await link_safety_check(long_url)
+    return await fetch_title(long_url)
+
+def insert_link(db: Session, link_model: database_models.Links) -> None:
+    """
+    Insert a new link, allocating its short code unless it has an alias.
+    """
+    for _ in range(SHORT_CODE_ATTEMPTS):
+        if not link_model.alias:
+            link_model.short_code = short_codes.allocate(db)
+            link_model.short_url = API_URL + link_model.short_code
+        db.add(link_model)
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            db.rollback()
+            if link_model.alias:
+                # Someone claimed the alias since we checked
+                raise HTTPException(409, detail="A different Link already uses this alias.")
+            # Allocated codes can still meet a code from the old random scheme
+    raise HTTPException(503, detail="Could not allocate a short code, try again.")
+
 async def create_link_for_user(db: Session, user, link: LinkRequest) -> database_models.Links:
     user_id = user.get('id')
     if not user_id:
@@ -216,16 +951,19 @@ async def create_link_for_user(db: Session, user, link: LinkRequest) -> database
 
     timestamp = datetime.now(timezone.utc)
     long_url = str(link.original_url)
+    long_url_hash = url_hash(long_url)
     
     #check for existing link with same URL
     link_check = db.query(database_models.Links).filter(
-        database_models.Links.original_url == long_url).first()
+        database_models.Links.url_hash == long_url_hash).first()
     if link_check:
         user_link_check = db.query(database_models.userLinks).filter(
             database_models.userLinks.user_id == user_id,
             database_models.userLinks.link_id == link_check.id,
         ).first()
         if user_link_check:
+            if link_check.status == database_models.LINK_FAILED:
+                retry_failed_links(db, redis_client, link_check.id)
             return link_check  # User already has this link
 
     if link.alias: #custom alias provided
@@ -234,55 +972,53 @@ async def create_link_for_user(db: Session, user, link: LinkRequest) -> database
                 (database_models.Links.short_code == link.alias)|
                 (database_models.Links.alias == link.alias)).first()
         if link_check:
-            if long_url != link_check.original_url:
+            if long_url_hash != link_check.url_hash:
                 raise HTTPException(409,detail="A different Link already uses this alias.")
             #same link already exists for different user, just link it to this user
             add_link_to_user(user_id, link_check.id, link.alias,
                              link.title if link.title else link_check.title, db)
+            if link_check.status == database_models.LINK_FAILED:
+                retry_failed_links(db, redis_client, link_check.id)
             return link_check
         
-        await link_safety_check(long_url)
-        title = await fetch_title(long_url)
+        title = await enrich_new_link(long_url, link)
         link_model = database_models.Links(
-        original_url = long_url, 
+        original_url = long_url, url_hash = long_url_hash,
         title = title, short_code = None, alias = link.alias,
         created_at=timestamp, short_url = API_URL + link.alias)
     
     else: #no custom alias
         #check for existing link with same URL
         link_check = db.query(database_models.Links).filter(
-            database_models.Links.original_url == long_url, 
+            database_models.Links.url_hash == long_url_hash, 
             database_models.Links.short_code != None).first()
         if link_check:
             #same link already exists for different user, just link it to this user
             add_link_to_user(user_id, link_check.id, link_check.short_code,
                              link.title if link.title else link_check.title, db)
+            if link_check.status == database_models.LINK_FAILED:
+                retry_failed_links(db, redis_client, link_check.id)
             return link_check
     
-        short_code = getString()
-        
-        while db.query(database_models.Links).filter(
-            database_models.Links.short_code == short_code).first():
-            short_code = getString() 
-        
-        await link_safety_check(long_url)
-        title = await fetch_title(long_url)
+        title = await enrich_new_link(long_url, link)
         link_model = database_models.Links(
-        original_url = long_url, 
-        title = title, short_code = short_code, alias = None,
-        created_at=timestamp, short_url = API_URL + short_code)
+        original_url = long_url, url_hash = long_url_hash,
+        title = title, short_code = None, alias = None,
+        created_at=timestamp)
     
+    if ASYNC_LINK_ENRICHMENT:
+        link_model.status = database_models.LINK_PENDING
+    insert_link(db, link_model)
     key = link_model.short_code if link_model.short_code else link_model.alias
-    if link.generate_qr and not link_model.qr_code_path:
+    if link.generate_qr and not ASYNC_LINK_ENRICHMENT:
         #generates QR code and uploads to AWS S3
-        qr_code_img = generate_qr_code(f"http://{API_URL}{key}")
-        qr_s3_url = upload_qr_to_s3(key, qr_code_img.getvalue())
-        link_model.qr_code_path = qr_s3_url
-    db.add(link_model)
-    db.commit()
+        _, link_model.qr_code_path = await create_qr(f"http://{API_URL}{key}")
+        db.commit()
     add_link_to_user(user_id, link_model.id, key,
                      link.title if link.title else title, db)
     db.refresh(link_model)
+    if ASYNC_LINK_ENRICHMENT:
+        enqueue_enrichment(redis_client, link_model.id, bool(link.generate_qr))
 
     return link_model
 
@@ -307,8 +1043,9 @@ def update_link(user: user_dependency, db: db_dependency,
         db_link.tags = update.tags
     db.commit()
 
-    # Invalidate caches
-    redis.delete(links_user(user_id)) 
+    # Update caches
+    refresh_user_links(db, redis, user_id, db_link.link_id)
+    invalidate_link_keys(redis, key)
     return "Link updated"
 
 @router.delete("/by_key/",status_code=status.HTTP_200_OK)
@@ -333,10 +1070,11 @@ async def delete_link_by_key(user: user_dependency, key:str, db:Session = Depend
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Link not found for this user")
 
         # Delete ONLY the user_link row
+        member = (db_link.created_at, user_link.id)
         db.delete(user_link)
         db.commit()
-        # Invalidate caches
-        redis.delete(links_user(user_id))
+        # Update caches
+        remove_user_links(redis, user_id, member)
 
         remaining = db.query(database_models.userLinks).filter(
             database_models.userLinks.link_id == db_link.id
@@ -346,8 +1084,7 @@ async def delete_link_by_key(user: user_dependency, key:str, db:Session = Depend
             db.delete(db_link)
             db.commit()
 
-            redis.delete(link_key(db_link.short_code))
-            redis.delete(link_key(db_link.alias))
+            invalidate_link_keys(redis, db_link.short_code, db_link.alias)
 
         return "Link deleted"
     #return "Link not found"
@@ -371,27 +1108,6 @@ async def get_link_title(user: user_dependency, url: str):
     
     return Response(content=await fetch_title(url) , media_type="text/plain")
 
-async def fetch_title(url: str) -> str:
-    try:
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            resp = await client.get(url)
-    except httpx.RequestError as exc:
-        #raise HTTPException(status_code=400, detail=f"Error fetching URL: {exc}") from exc
-        return "Failed to Fetch Title"
-
-    if resp.status_code != 200:
-        #raise HTTPException(status_code=resp.status_code,detail=f"Failed to fetch URL (status {resp.status_code})")
-        return "Failed to Fetch Title"
-
-    # Parse HTML
-    soup = BeautifulSoup(resp.text, "html.parser")
-    title_tag = soup.find("title")
-
-    if not title_tag or not title_tag.string:
-        return "No Title"
-
-    return title_tag.string.strip()
-
 @router.websocket("/ws/batch-upload/")
 async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), redis: Redis = Depends(get_redis)):
     token = websocket.query_params.get("token")
@@ -406,7 +1122,7 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
         return
 
     try:
-        user = decode_user_from_token(token)  # already returns username/id/role
+        user = await decode_user_from_token(token)  # already returns username/id/role
     except HTTPException:
         await websocket.close(code=1008, reason="Authentication failed")
         return
@@ -422,31 +1138,38 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
     total = None  # you can fill this from "start" message if client sends it
     index = 0
 
-    try:
-        while True:
-            message = await websocket.receive_json()
-
-            mtype = message.get("type")
-
-            if mtype == "start":
-                total = message.get("total")
-                await websocket.send_json({
-                    "type": "started",
-                    "total": total,
-                })
-
-            elif mtype == "item":
-                index += 1
-                raw = message.get("data") or {}
+    # Bounded so a fast client waits for the workers instead of piling up items
+    items: asyncio.Queue = asyncio.Queue(maxsize=WS_BATCH_CONCURRENCY * 2)
+    send_lock = asyncio.Lock()
+    link_ids: list[int] = []
+    # Items for the same URL take turns, so a later one finds the link the first created
+    url_locks: dict[str, asyncio.Lock] = {}
+
+    async def send(message: dict):
+        # Workers finish in any order; sends must not interleave
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def process_items():
+        nonlocal processed
+        # One session per worker; sessions can't be shared between concurrent tasks
+        worker_db = sessionLocal()
+        try:
+            while True:
+                item_index, raw = await items.get()
                 try:
                     # Validate payload using your Link Pydantic model
                     link = LinkRequest(**raw)
-                    link_model = await create_link_for_user(db, user, link)
-                    redis.delete(links_user(user_id))
+                    url_lock = url_locks.setdefault(url_hash(str(link.original_url)), asyncio.Lock())
+                    async with url_lock:
+                        link_model = await create_link_for_user(worker_db, user, link)
+                    link_ids.append(link_model.id)
+                    # Resolvable on every worker before the client sees the short URL
+                    register_link_keys(redis, link_model.short_code, link_model.alias)
                     processed += 1
-                    await websocket.send_json({
+                    await send({
                         "type": "item_result",
-                        "index": index,
+                        "index": item_index,
                         "status": "ok",
                         "id": link_model.id,
                         "short_url": link_model.short_url,
@@ -456,33 +1179,59 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
 
                 except HTTPException as e:
                     # Business logic error
-                    await websocket.send_json({
+                    worker_db.rollback()
+                    await send({
                         "type": "item_result",
-                        "index": index,
+                        "index": item_index,
                         "status": "error",
                         "code": e.status_code,
                         "detail": e.detail,
                     })
                 except Exception as e:
                     # Unexpected error
-                    await websocket.send_json({
+                    worker_db.rollback()
+                    await send({
                         "type": "item_result",
-                        "index": index,
+                        "index": item_index,
                         "status": "error",
                         "code": 500,
                         "detail": str(e),
                     })
+                finally:
+                    items.task_done()
 
                 # Optional: also send progress
                 if total:
-                    await websocket.send_json({
+                    await send({
                         "type": "progress",
                         "processed": processed,
                         "total": total,
                     })
+        finally:
+            worker_db.close()
+
+    workers = [asyncio.create_task(process_items()) for _ in range(WS_BATCH_CONCURRENCY)]
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+
+            mtype = message.get("type")
+
+            if mtype == "start":
+                total = message.get("total")
+                await send({
+                    "type": "started",
+                    "total": total,
+                })
+
+            elif mtype == "item":
+                index += 1
+                await items.put((index, message.get("data") or {}))
 
             elif mtype == "finish":
-                await websocket.send_json({
+                await items.join()
+                await send({
                     "type": "finished",
                     "processed": processed,
                     "total": total,
@@ -491,7 +1240,10 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
                 return
             
             elif mtype == "cancel":
-                await websocket.send_json({
+                # Stops the workers; links created so far are kept
+                for worker in workers:
+                    worker.cancel()
+                await send({
                     "type": "cancelled",
                     "processed": processed,
                     "total": total,
@@ -501,7 +1253,7 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
 
             else:
                 # Unknown message type
-                await websocket.send_json({
+                await send({
                     "type": "error",
                     "detail": f"Unknown message type: {mtype}",
                 })
@@ -509,6 +1261,13 @@ async def ws_batch_upload(websocket: WebSocket, db: Session = Depends(get_db), r
     except WebSocketDisconnect:
         # Client ended connection
         return
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # The user's list is refreshed once for the whole batch
+        if link_ids:
+            refresh_user_links(db, redis, user_id, *link_ids)
         
 
 def add_link_to_user(user_id: int, link_id: int, key: str, title: str, db: db_dependency):
@@ -2,11 +2,11 @@ from typing import Optional, Annotated
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from utils.database_models import Users
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from utils.database import sessionLocal, engine
 from starlette import status
 from .auth import get_current_user
+from security.passwords import hash_password, verify_password
 
 router = APIRouter(
     prefix='/user',
@@ -37,7 +37,6 @@ def user_to_dict(user: Users) -> dict:
 
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
-bcrypt_context = CryptContext(schemes=['bcrypt'],deprecated = 'auto')
 
 class UserVerification(BaseModel):
     password: str
@@ -59,10 +58,10 @@ async def change_password(user:user_dependency, db:db_dependency,
     
     user_model = db.query(Users).filter(Users.id == user.get('id')).first()
 
-    if not bcrypt_context.verify(user_verification.password, 
+    if not await verify_password(user_verification.password, 
                                  user_model.hashed_password):#type:ignore
         raise HTTPException(401, detail='Old password did not match.')
-    user_model.hashed_password = bcrypt_context.hash(user_verification.new_password) #type:ignore
+    user_model.hashed_password = await hash_password(user_verification.new_password) #type:ignore
     db.commit()
     return 'Password Changed'
 
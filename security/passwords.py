@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+T = TypeVar("T")
+
+bcrypt_context = CryptContext(schemes=['bcrypt'],deprecated = 'auto')
+
+# bcrypt releases the GIL, so a few threads hash in parallel without touching the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes waiting or running before new ones are turned away with 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+OTP_SECRET_KEY = os.getenv("OTP_SECRET_KEY") or os.getenv('JWT_SECRET_KEY', 'your-secret-key')
+OTP_HMAC_PREFIX = "hmac-sha256$"
+
+class BoundedExecutor:
+    """
+    Thread pool with a cap on outstanding work and counters for /admin/metrics.
+    Only used from the event loop thread, so the counters need no lock.
+    """
+    def __init__(self, workers: int, max_pending: int, name: str):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(503, detail="Server is busy, try again shortly.", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+password_executor = BoundedExecutor(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, "password-hash")
+
+async def hash_password(password: str) -> str:
+    return await password_executor.run(bcrypt_context.hash, password)
+
+async def verify_password(password: str, hashed: Optional[str]) -> bool:
+    if not hashed:
+        return False
+    return await password_executor.run(bcrypt_context.verify, password, hashed)
+
+def hash_otp(code: str, context: str) -> str:
+    """
+    OTPs live for minutes and allow a handful of attempts, so a keyed HMAC is enough;
+    `context` (e.g. the Redis key) binds the code to one recipient.
+    """
+    digest = hmac.new(OTP_SECRET_KEY.encode(), f"{context}:{code}".encode(), hashlib.sha256).hexdigest()
+    return OTP_HMAC_PREFIX + digest
+
+def verify_otp(code: str, context: str, stored: str) -> bool:
+    """
+    Called from sync handlers, which already run in the threadpool.
+    """
+    if stored.startswith(OTP_HMAC_PREFIX):
+        return hmac.compare_digest(hash_otp(code, context), stored)
+    # Entries written before the HMAC scheme were bcrypt hashes
+    return bcrypt_context.verify(code, stored)
@@ -0,0 +1,48 @@
+import os
+from utils import invalidation
+from utils.database import async_redis_client, redis_client
+from utils.hotcache import HotKeyCache
+
+# user id -> epoch. Access tokens carry the epoch they were issued under and are
+# rejected once it is bumped, e.g. after a role change or deletion.
+USER_EPOCHS_KEY = "user_epochs"
+# Safety net in case a pub/sub bump is missed; bumps normally arrive immediately
+EPOCH_CACHE_TTL_SECONDS = 60
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+class UserEpochs:
+    def __init__(self, maxsize: int, ttl: float):
+        self._local = HotKeyCache(maxsize, ttl)
+
+    def current(self, user_id: int) -> int:
+        epoch = self._local.get(user_id)
+        if epoch is None:
+            epoch = int(redis_client.hget(USER_EPOCHS_KEY, str(user_id)) or 0) # type: ignore
+            self._local.set(user_id, epoch)
+        return epoch
+
+    async def current_async(self, user_id: int) -> int:
+        """
+        current() for the event loop; a cache miss reads Redis without blocking it.
+        """
+        epoch = self._local.get(user_id)
+        if epoch is None:
+            epoch = int(await async_redis_client.hget(USER_EPOCHS_KEY, str(user_id)) or 0) # type: ignore
+            self._local.set(user_id, epoch)
+        return epoch
+
+    def bump(self, user_id: int) -> int:
+        """
+        Revoke every token issued to the user so far, in all workers.
+        """
+        epoch = int(redis_client.hincrby(USER_EPOCHS_KEY, str(user_id), 1)) # type: ignore
+        self._local.set(user_id, epoch)
+        invalidation.publish(redis_client, "user_epoch", user_id=user_id, epoch=epoch)
+        return epoch
+
+    def apply(self, data: dict) -> None:
+        self._local.set(data["user_id"], data["epoch"])
+
+user_epochs = UserEpochs(TOKEN_CACHE_SIZE, EPOCH_CACHE_TTL_SECONDS)
+invalidation.subscribe("user_epoch", user_epochs.apply)
@@ -1,18 +1,55 @@
-import requests
+import asyncio
+import hashlib
 from typing import Optional
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI
 import json
+from utils.database import async_redis_client
+from utils.http import get_http_client
+from utils.urls import normalize_url, url_domain
+from .safebrowsing_local import LocalSafeBrowsingDB, DB_PATH
 
-SAFE_BROWSING_URL = (
-    "https://safebrowsing.googleapis.com/v4/threatMatches:find"
+# Overridable so a local stub can stand in for the API
+SAFE_BROWSING_URL = os.getenv(
+    "SAFE_BROWSING_URL", "https://safebrowsing.googleapis.com/v4/threatMatches:find"
 )
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-async def check_url_with_google_safe_browsing(url: str) -> Optional[dict]:
+UNSAFE_CATEGORIES = ("spam", "scam_or_phishing", "extremely_high_risk")
+
+SAFE_VERDICT_TTL_SECONDS = 6 * 3600
+UNSAFE_VERDICT_TTL_SECONDS = 24 * 3600
+
+_openai: Optional[AsyncOpenAI] = None
+
+def get_openai_client() -> AsyncOpenAI:
+    global _openai
+    if _openai is None:
+        # Shares the pooled HTTP client; OPENAI_BASE_URL can point it at a stub
+        _openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_http_client())
+    return _openai
+
+def url_verdict_key(url: str) -> str:
+    return f"safety:url:{hashlib.sha256(url.encode()).hexdigest()}"
+
+def domain_verdict_key(domain: str) -> str:
+    return f"safety:domain:{domain}"
+
+THREAT_TYPES = [
+    "MALWARE",
+    "SOCIAL_ENGINEERING",
+    "UNWANTED_SOFTWARE",
+    "POTENTIALLY_HARMFUL_APPLICATION",
+]
+
+# threatMatches:find accepts at most 500 threatEntries per request
+SAFE_BROWSING_MAX_ENTRIES = 500
+# How long a lookup waits for others to share its request
+SAFE_BROWSING_BATCH_WINDOW_SECONDS = float(os.getenv("SAFE_BROWSING_BATCH_WINDOW_SECONDS", "0.02"))
+
+async def find_threat_matches(urls: list[str]) -> dict[str, list[dict]]:
     """
-    Returns the raw 'matches' dict if the URL is unsafe,
-    or None if it appears safe.
+    Look up to SAFE_BROWSING_MAX_ENTRIES URLs in one request.
+    Returns the matches of each flagged URL; safe URLs are absent.
     """
     payload = {
         "client": {
@@ -20,25 +57,92 @@ async def check_url_with_google_safe_browsing(url: str) -> Optional[dict]:
             "clientVersion": "1.0"
         },
         "threatInfo": {
-            "threatTypes": [
-                "MALWARE",
-                "SOCIAL_ENGINEERING",
-                "UNWANTED_SOFTWARE",
-                "POTENTIALLY_HARMFUL_APPLICATION",
-            ],
+            "threatTypes": THREAT_TYPES,
             "platformTypes": ["ANY_PLATFORM"],
             "threatEntryTypes": ["URL"],
-            "threatEntries": [{"url": url}],
+            "threatEntries": [{"url": url} for url in urls],
         },
     }
 
     params = {"key": os.getenv("SAFE_BROWSING_API_KEY")}
-    resp = requests.post(SAFE_BROWSING_URL, params=params, json=payload, timeout=5)
+    resp = await get_http_client().post(SAFE_BROWSING_URL, params=params, json=payload, timeout=5)
     resp.raise_for_status()
     data = resp.json() or {}
 
-    # If there are matches, it's unsafe
-    return data.get("matches")
+    matches: dict[str, list[dict]] = {}
+    for match in data.get("matches", []):
+        matches.setdefault(match["threat"]["url"], []).append(match)
+    return matches
+
+class SafeBrowsingBatcher:
+    """
+    Coalesces lookups arriving within a short window into one threatMatches:find request
+    and hands each caller its own result.
+    """
+    def __init__(self, window: float, max_entries: int):
+        self.window = window
+        self.max_entries = max_entries
+        self._pending: dict[str, list[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Strong references so in-flight requests aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def check(self, url: str) -> Optional[list[dict]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(url, []).append(future)
+        if len(self._pending) >= self.max_entries:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: dict[str, list[asyncio.Future]]) -> None:
+        try:
+            matches = await find_threat_matches(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for url, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(matches.get(url))
+
+safe_browsing_batcher = SafeBrowsingBatcher(SAFE_BROWSING_BATCH_WINDOW_SECONDS, SAFE_BROWSING_MAX_ENTRIES)
+
+# "lookup" asks threatMatches:find for every URL; "update" keeps the lists locally
+SAFE_BROWSING_MODE = os.getenv("SAFE_BROWSING_MODE", "lookup")
+local_safe_browsing = LocalSafeBrowsingDB(THREAT_TYPES, DB_PATH) if SAFE_BROWSING_MODE == "update" else None
+
+async def check_url_with_google_safe_browsing(url: str) -> Optional[list[dict]]:
+    """
+    Returns the raw 'matches' list if the URL is unsafe,
+    or None if it appears safe.
+    """
+    if local_safe_browsing is not None and local_safe_browsing.ready:
+        return await local_safe_browsing.lookup(url)
+    # Lookup mode, or the local lists haven't been fetched yet
+    return await safe_browsing_batcher.check(url)
+
+async def check_domain_with_google_safe_browsing(domain: str) -> Optional[list[dict]]:
+    """
+    Safe Browsing lists a bare host expression ("evil.example/") only when the whole
+    host is bad, so a match on the host root is a verdict for every URL on it.
+    """
+    return await check_url_with_google_safe_browsing(f"http://{domain}/")
 
 async def classify_url_with_openai(url: str):
     prompt = f"""
@@ -59,7 +163,7 @@ async def classify_url_with_openai(url: str):
         }}
     """
 
-    resp = client.chat.completions.create(
+    resp = await get_openai_client().chat.completions.create(
         model="gpt-4.1-mini",
         messages=[{"role": "user", "content": prompt}],
         response_format={"type": "json_object"},
@@ -68,4 +172,44 @@ async def classify_url_with_openai(url: str):
     content = resp.choices[0].message.content
     assert content is not None
     # In JSON mode, this should already be a raw JSON string
-    return json.loads(content)
\ No newline at end of file
+    return json.loads(content)
+
+async def check_url_safety(url: str) -> str:
+    """
+    Returns 'safe', 'threat' (Safe Browsing match) or 'spam' (OpenAI classification),
+    answering from the verdict cache when possible.
+    """
+    normalized = normalize_url(url)
+    domain = url_domain(normalized)
+    url_key, domain_key = url_verdict_key(normalized), domain_verdict_key(domain)
+
+    cached_url, cached_domain = await async_redis_client.mget(url_key, domain_key)
+    if cached_domain == "threat":
+        return "threat"
+    if cached_url:
+        return cached_url
+
+    # The remote checks run concurrently; an error in any of them is not cached
+    checks = [check_url_with_google_safe_browsing(url), classify_url_with_openai(url)]
+    if domain and cached_domain is None:
+        checks.append(check_domain_with_google_safe_browsing(domain))
+    threat, classify, *domain_threat = await asyncio.gather(*checks)
+    if threat or any(domain_threat):
+        verdict = "threat"
+    elif classify.get("category") in UNSAFE_CATEGORIES:
+        verdict = "spam"
+    else:
+        verdict = "safe"
+
+    pipe = async_redis_client.pipeline(transaction=False)
+    if verdict == "safe":
+        pipe.set(url_key, verdict, ex=SAFE_VERDICT_TTL_SECONDS)
+    else:
+        pipe.set(url_key, verdict, ex=UNSAFE_VERDICT_TTL_SECONDS)
+    if domain_threat:
+        if domain_threat[0]:
+            pipe.set(domain_key, "threat", ex=UNSAFE_VERDICT_TTL_SECONDS)
+        else:
+            pipe.set(domain_key, "safe", ex=SAFE_VERDICT_TTL_SECONDS)
+    await pipe.execute()
+    return verdict
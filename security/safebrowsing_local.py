@@ -0,0 +1,392 @@
+"""
+Local Safe Browsing (Update API v4) database.
+
+Keeps the hash-prefix lists in compact sorted byte arrays, optionally backed by
+memory-mapped files, so most URLs are judged in-process. Only prefix hits need a
+fullHashes:find round trip.
+"""
+import asyncio
+import base64
+import bisect
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import re
+import time
+import uuid
+from typing import Optional, Union
+from urllib.parse import unquote_to_bytes, urlsplit
+from utils.http import get_http_client
+
+UPDATE_URL = os.getenv(
+    "SAFE_BROWSING_UPDATE_URL", "https://safebrowsing.googleapis.com/v4/threatListUpdates:fetch"
+)
+FULL_HASHES_URL = os.getenv(
+    "SAFE_BROWSING_FULL_HASHES_URL", "https://safebrowsing.googleapis.com/v4/fullHashes:find"
+)
+# Directory for the memory-mapped lists; empty keeps them in memory only
+DB_PATH = os.getenv("SAFE_BROWSING_DB_PATH", "")
+DEFAULT_WAIT_SECONDS = 30 * 60
+RETRY_WAIT_SECONDS = 60
+# Every API worker writes its own snapshot; list files no snapshot refers to are deleted
+# once they are this old, by which time every worker has moved on from them
+STALE_SNAPSHOT_SECONDS = 10 * 60
+
+CLIENT = {"clientId": "linkbottle", "clientVersion": "1.0"}
+
+Blob = Union[bytes, mmap.mmap]
+
+# ---------------------------------------------------------------- canonicalization
+
+def _unescape(value: str) -> str:
+    # Percent-unescape until stable; latin-1 keeps every byte as one character
+    previous = None
+    while value != previous:
+        previous = value
+        value = unquote_to_bytes(value).decode("latin-1")
+    return value
+
+def _escape(value: str) -> str:
+    return "".join(
+        f"%{ord(c):02X}" if ord(c) <= 0x20 or ord(c) >= 0x7F or c in "#%" else c
+        for c in value
+    )
+
+def _canonical_host(host: str) -> str:
+    host = _unescape(host).strip(".").lower()
+    host = re.sub(r"\.{2,}", ".", host)
+    if host.isdigit():
+        # Hosts like http://3279880203/ are IPv4 addresses in decimal
+        try:
+            return str(ipaddress.IPv4Address(int(host)))
+        except ValueError:
+            pass
+    return host
+
+def _canonical_path(path: str) -> str:
+    path = _unescape(path) or "/"
+    trailing = path.endswith("/")
+    parts: list[str] = []
+    for segment in path.split("/"):
+        if segment in ("", "."):
+            continue
+        if segment == "..":
+            if parts:
+                parts.pop()
+            continue
+        parts.append(segment)
+    result = "/" + "/".join(parts)
+    if trailing and parts:
+        result += "/"
+    return result
+
+def canonicalize(url: str) -> tuple[str, str, Optional[str]]:
+    """
+    Returns the canonical (host, path, query) of a URL as defined by the Safe Browsing spec.
+    """
+    url = re.sub(r"[\t\r\n]", "", url.strip()).split("#", 1)[0]
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    netloc = parts.netloc.rsplit("@", 1)[-1]
+    host = netloc.rsplit(":", 1)[0] if not netloc.endswith("]") else netloc
+    query = parts.query if "?" in url else None
+    return (
+        _escape(_canonical_host(host)),
+        _escape(_canonical_path(parts.path)),
+        _escape(query) if query is not None else None,
+    )
+
+def url_expressions(url: str) -> list[str]:
+    """
+    The host-suffix / path-prefix combinations looked up for a URL.
+    """
+    host, path, query = canonicalize(url)
+
+    hosts = [host]
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        components = host.split(".")[-5:]
+        for i in range(len(components) - 1):
+            suffix = ".".join(components[i:])
+            if suffix != host and len(hosts) < 5:
+                hosts.append(suffix)
+
+    paths = []
+    if query is not None:
+        paths.append(f"{path}?{query}")
+    paths.append(path)
+    # Only directory components; the final file name is covered by the exact path
+    segments = path.strip("/").split("/")
+    if not path.endswith("/"):
+        segments = segments[:-1]
+    prefix = "/"
+    for segment in [""] + segments[:3]:
+        if segment:
+            prefix += segment + "/"
+        if prefix not in paths and len(paths) < 6:
+            paths.append(prefix)
+
+    return [h + p for h in hosts for p in paths]
+
+def url_hashes(url: str) -> list[bytes]:
+    return [hashlib.sha256(expr.encode("latin-1")).digest() for expr in url_expressions(url)]
+
+# ---------------------------------------------------------------- storage
+
+class PrefixSet:
+    """
+    Sorted hash prefixes of one length packed into a single byte string.
+    """
+    def __init__(self, size: int, blob: Blob):
+        self.size = size
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.blob) // self.size
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[i * self.size:(i + 1) * self.size])
+
+    def __contains__(self, prefix: bytes) -> bool:
+        i = bisect.bisect_left(self, prefix)  # type: ignore
+        return i < len(self) and self[i] == prefix
+
+    def items(self) -> list[bytes]:
+        return [self[i] for i in range(len(self))]
+
+    def close(self) -> None:
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+
+class ThreatList:
+    def __init__(self, threat_type: str):
+        self.threat_type = threat_type
+        self.state = ""
+        self.prefixes: dict[int, PrefixSet] = {}
+
+    def sorted_prefixes(self) -> list[bytes]:
+        # Removal indices and the checksum refer to all prefixes in one lexicographic order
+        return sorted(p for prefix_set in self.prefixes.values() for p in prefix_set.items())
+
+    def contains(self, full_hash: bytes) -> Optional[bytes]:
+        for size, prefix_set in self.prefixes.items():
+            if full_hash[:size] in prefix_set:
+                return full_hash[:size]
+        return None
+
+    @staticmethod
+    def pack(prefixes: list[bytes]) -> dict[int, PrefixSet]:
+        by_size: dict[int, list[bytes]] = {}
+        for prefix in prefixes:
+            by_size.setdefault(len(prefix), []).append(prefix)
+        return {size: PrefixSet(size, b"".join(sorted(items))) for size, items in by_size.items()}
+
+class LocalSafeBrowsingDB:
+    def __init__(self, threat_types: list[str], path: str = ""):
+        self.lists = {t: ThreatList(t) for t in threat_types}
+        self.path = path
+        self.next_update_at = 0.0
+        self.ready = False
+
+    # ------------------------------------------------------------ lookups
+
+    def prefix_hits(self, hashes: list[bytes]) -> set[bytes]:
+        hits = set()
+        for threat_list in self.lists.values():
+            for full_hash in hashes:
+                prefix = threat_list.contains(full_hash)
+                if prefix is not None:
+                    hits.add(prefix)
+        return hits
+
+    async def lookup(self, url: str) -> Optional[list[dict]]:
+        """
+        Returns the full-hash matches for `url`, or None if it is not listed.
+        Only URLs with a local prefix hit cost a request.
+        """
+        hashes = url_hashes(url)
+        hits = self.prefix_hits(hashes)
+        if not hits:
+            return None
+        matches = await self.find_full_hashes(hits)
+        wanted = {base64.b64encode(h).decode() for h in hashes}
+        listed = [m for m in matches if m["threat"]["hash"] in wanted]
+        return listed or None
+
+    async def find_full_hashes(self, prefixes: set[bytes]) -> list[dict]:
+        payload = {
+            "client": CLIENT,
+            "clientStates": [tl.state for tl in self.lists.values() if tl.state],
+            "threatInfo": {
+                "threatTypes": list(self.lists),
+                "platformTypes": ["ANY_PLATFORM"],
+                "threatEntryTypes": ["URL"],
+                "threatEntries": [{"hash": base64.b64encode(p).decode()} for p in prefixes],
+            },
+        }
+        params = {"key": os.getenv("SAFE_BROWSING_API_KEY")}
+        resp = await get_http_client().post(FULL_HASHES_URL, params=params, json=payload, timeout=5)
+        resp.raise_for_status()
+        return (resp.json() or {}).get("matches", [])
+
+    # ------------------------------------------------------------ updates
+
+    async def update(self) -> None:
+        payload = {
+            "client": CLIENT,
+            "listUpdateRequests": [
+                {
+                    "threatType": tl.threat_type,
+                    "platformType": "ANY_PLATFORM",
+                    "threatEntryType": "URL",
+                    "state": tl.state,
+                    "constraints": {"supportedCompressions": ["RAW"]},
+                }
+                for tl in self.lists.values()
+            ],
+        }
+        params = {"key": os.getenv("SAFE_BROWSING_API_KEY")}
+        resp = await get_http_client().post(UPDATE_URL, params=params, json=payload, timeout=60)
+        resp.raise_for_status()
+        data = resp.json() or {}
+
+        for update in data.get("listUpdateResponses", []):
+            threat_list = self.lists.get(update["threatType"])
+            if threat_list is not None:
+                # Sorting and merging large lists is CPU-bound; keep it off the event loop
+                merged = await asyncio.to_thread(self.apply_update, threat_list, update)
+                self.install({threat_list.threat_type: merged})
+
+        wait = data.get("minimumWaitDuration", f"{DEFAULT_WAIT_SECONDS}s")
+        self.next_update_at = time.monotonic() + float(wait.rstrip("s"))
+        if self.path:
+            # Serve from our own snapshot's maps rather than the in-memory copies
+            state = await asyncio.to_thread(self.save)
+            self.install(await asyncio.to_thread(self.map_snapshot, state))
+
+    def apply_update(self, threat_list: ThreatList, update: dict) -> tuple[str, dict[int, PrefixSet]]:
+        """
+        Returns the list's new client state and prefixes; the caller installs them.
+        """
+        prefixes = [] if update.get("responseType") == "FULL_UPDATE" else threat_list.sorted_prefixes()
+
+        removed: set[int] = set()
+        for removal in update.get("removals", []):
+            removed.update(removal.get("rawIndices", {}).get("indices", []))
+        if removed:
+            prefixes = [p for i, p in enumerate(prefixes) if i not in removed]
+
+        for addition in update.get("additions", []):
+            raw = addition.get("rawHashes")
+            if not raw:
+                continue
+            size = raw["prefixSize"]
+            blob = base64.b64decode(raw["rawHashes"])
+            prefixes.extend(blob[i:i + size] for i in range(0, len(blob), size))
+
+        prefixes.sort()
+        expected = update.get("checksum", {}).get("sha256")
+        if expected and base64.b64encode(hashlib.sha256(b"".join(prefixes)).digest()).decode() != expected:
+            # Out of sync: drop the list and ask for a full update next time
+            return "", {}
+        return update.get("newClientState", ""), ThreatList.pack(prefixes)
+
+    # ------------------------------------------------------------ persistence
+
+    def save(self) -> dict:
+        """
+        Write the lists as a new snapshot under names unique to this call, then point
+        state.json at it. Several workers can save into the same directory.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        generation = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        state = {}
+        for tl in self.lists.values():
+            files = {}
+            for size, prefix_set in tl.prefixes.items():
+                name = f"{tl.threat_type}.{size}.{generation}.bin"
+                with open(os.path.join(self.path, name + ".tmp"), "wb") as f:
+                    f.write(prefix_set.blob)
+                os.replace(os.path.join(self.path, name + ".tmp"), os.path.join(self.path, name))
+                files[str(size)] = name
+            state[tl.threat_type] = {"state": tl.state, "files": files}
+        tmp = os.path.join(self.path, f"state.json.{generation}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self.path, "state.json"))
+        self.prune(state)
+        return state
+
+    def prune(self, state: dict) -> None:
+        current = {name for saved in state.values() for name in saved["files"].values()}
+        cutoff = time.time() - STALE_SNAPSHOT_SECONDS
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith((".bin", ".tmp")) or entry.name in current:
+                continue
+            try:
+                # Unlinking doesn't disturb workers that still have the file mapped
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def read_state(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, "state.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def map_snapshot(self, state: dict) -> dict[str, tuple[str, dict[int, PrefixSet]]]:
+        """
+        Map a saved snapshot into memory; the OS pages it in on demand.
+        """
+        mapped = {}
+        for threat_type, saved in state.items():
+            if threat_type not in self.lists or "files" not in saved:
+                continue
+            prefixes = {}
+            for size, name in saved["files"].items():
+                with open(os.path.join(self.path, name), "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        blob: Blob = b""
+                    else:
+                        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                prefixes[int(size)] = PrefixSet(int(size), blob)
+            mapped[threat_type] = (saved["state"], prefixes)
+        return mapped
+
+    def install(self, mapped: dict[str, tuple[str, dict[int, PrefixSet]]]) -> None:
+        """
+        Swap mapped lists in and close the maps they replace. Runs on the event loop,
+        so no lookup is reading the old maps meanwhile.
+        """
+        for threat_type, (state, prefixes) in mapped.items():
+            tl = self.lists[threat_type]
+            old, tl.prefixes, tl.state = tl.prefixes, prefixes, state
+            for prefix_set in old.values():
+                prefix_set.close()
+        self.ready = all(tl.state for tl in self.lists.values())
+
+    def load(self) -> dict[str, tuple[str, dict[int, PrefixSet]]]:
+        state = self.read_state()
+        try:
+            return self.map_snapshot(state) if state else {}
+        except FileNotFoundError:
+            # A snapshot from a worker that has moved on; the next update fetches fresh lists
+            return {}
+
+    async def refresh_forever(self) -> None:
+        if self.path:
+            self.install(await asyncio.to_thread(self.load))
+        while True:
+            try:
+                await self.update()
+            except Exception:
+                # Keep serving the last good lists; the remote API may just be slow
+                self.next_update_at = time.monotonic() + RETRY_WAIT_SECONDS
+            await asyncio.sleep(max(self.next_update_at - time.monotonic(), 1))
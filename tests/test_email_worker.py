@@ -0,0 +1,94 @@
+"""
+email_worker against fakeredis, with a stub in place of SES/SMTP.
+"""
+import asyncio
+import json
+import threading
+import time
+import fakeredis
+import pytest
+import email_worker
+from utils.email_queue import EMAIL_QUEUE_KEY, EMAIL_RETRY_KEY, EMAIL_PROCESSING_PREFIX, EMAIL_ALIVE_PREFIX, enqueue_email
+
+class StubMailer:
+    """
+    Records deliveries; each address in `fail_once` fails on its first attempt.
+    """
+    def __init__(self, fail_once=()):
+        self.sent: list[tuple[str, str, dict]] = []
+        self.fail_once = set(fail_once)
+        self.lock = threading.Lock()
+
+    def deliver(self, to: str, template: str, params: dict) -> None:
+        with self.lock:
+            if to in self.fail_once:
+                self.fail_once.discard(to)
+                raise ConnectionError("SMTP stub refused the connection")
+            self.sent.append((to, template, params))
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def redis(server, monkeypatch):
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(email_worker, "redis_client", client)
+    monkeypatch.setattr(email_worker, "promote_script", client.register_script(email_worker.PROMOTE_DUE_SCRIPT))
+    monkeypatch.setattr(email_worker, "_stopping", threading.Event())
+    monkeypatch.setattr(email_worker, "RETRY_BASE_SECONDS", 0.05)
+    return client
+
+def mailer(monkeypatch, **kwargs) -> StubMailer:
+    stub = StubMailer(**kwargs)
+    monkeypatch.setattr(email_worker, "deliver", stub.deliver)
+    return stub
+
+def run_until(condition, timeout: float = 10) -> None:
+    worker = threading.Thread(target=email_worker.main_loop)
+    worker.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        email_worker._stopping.set()
+        worker.join()
+
+def enqueue(server, to: str, code: str) -> None:
+    # As the API does it
+    asyncio.run(enqueue_email(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), to, "otp", code=code))
+
+def test_failed_send_is_retried_with_backoff(server, redis, monkeypatch):
+    stub = mailer(monkeypatch, fail_once={"b@example.com"})
+    for i, to in enumerate(["a@example.com", "b@example.com", "c@example.com"]):
+        enqueue(server, to, f"00000{i}")
+
+    run_until(lambda: len(stub.sent) == 3)
+
+    assert sorted(to for to, _, _ in stub.sent) == ["a@example.com", "b@example.com", "c@example.com"]
+    assert redis.llen(EMAIL_QUEUE_KEY) == 0
+    assert redis.zcard(EMAIL_RETRY_KEY) == 0
+    assert redis.llen(email_worker.PROCESSING_KEY) == 0
+
+def test_recipient_rate_limit(server, redis, monkeypatch):
+    stub = mailer(monkeypatch)
+    monkeypatch.setattr(email_worker, "RATE_LIMIT_PER_HOUR", 2)
+    for i in range(4):
+        enqueue(server, "a@example.com", f"00000{i}")
+
+    run_until(lambda: redis.llen(EMAIL_QUEUE_KEY) == 0 and redis.llen(email_worker.PROCESSING_KEY) == 0)
+
+    assert len(stub.sent) == 2
+
+def test_jobs_of_dead_workers_are_requeued(redis):
+    job = json.dumps({"to": "a@example.com", "template": "otp", "params": {"code": "1"}, "attempts": 0})
+    redis.lpush(EMAIL_PROCESSING_PREFIX + "rescheduled-pod-1", job)
+    redis.lpush(EMAIL_PROCESSING_PREFIX + "live-pod-1", job)
+    redis.set(EMAIL_ALIVE_PREFIX + "live-pod-1", 1, ex=30)
+
+    email_worker.requeue_orphaned_jobs()
+
+    assert redis.lrange(EMAIL_QUEUE_KEY, 0, -1) == [job]
+    assert redis.llen(EMAIL_PROCESSING_PREFIX + "rescheduled-pod-1") == 0
+    assert redis.llen(EMAIL_PROCESSING_PREFIX + "live-pod-1") == 1
@@ -0,0 +1,86 @@
+"""
+QR code storage against S3 mocked by moto.
+"""
+import asyncio
+import hashlib
+import boto3
+import pytest
+from moto import mock_aws
+from utils import AWShelper, database_models, qrcodes
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name=AWShelper.AWS_REGION)
+        client.create_bucket(Bucket=AWShelper.AWS_BUCKET_NAME,
+                             CreateBucketConfiguration={"LocationConstraint": AWShelper.AWS_REGION})
+        monkeypatch.setattr(AWShelper, "s3", client)
+        yield client
+    qrcodes.shutdown_qr_pool()
+
+@pytest.fixture
+def puts(s3, monkeypatch):
+    """
+    Keys written with put_object, in order.
+    """
+    keys: list[str] = []
+    put_object = s3.put_object
+
+    def counting_put(**kwargs):
+        keys.append(kwargs["Key"])
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(s3, "put_object", counting_put)
+    return keys
+
+@pytest.fixture
+def renders(monkeypatch):
+    """
+    Data of every QR code rendered.
+    """
+    rendered: list[str] = []
+    render_qr = qrcodes.render_qr
+
+    async def counting_render(data: str) -> bytes:
+        rendered.append(data)
+        return await render_qr(data)
+
+    monkeypatch.setattr(qrcodes, "render_qr", counting_render)
+    return rendered
+
+def test_identical_image_is_uploaded_once(s3, puts):
+    png = qrcodes.render_qr_png("http://localhost/abc")
+    key = f"qr/{hashlib.sha256(png).hexdigest()}.png"
+
+    async def store_twice():
+        return await asyncio.gather(qrcodes.store_qr(png), qrcodes.store_qr(png))
+
+    first, second = asyncio.run(store_twice())
+    assert first == second == AWShelper.s3_public_url(key)
+    assert asyncio.run(qrcodes.store_qr(png)) == first
+    # The concurrent pair may both miss the HEAD; the later call always skips the PUT
+    assert 1 <= len(puts) <= 2 and set(puts) == {key}
+    stored = s3.get_object(Bucket=AWShelper.AWS_BUCKET_NAME, Key=key)
+    assert stored["Body"].read() == png
+    assert stored["ContentType"] == "image/png"
+
+def test_repeated_upload_skips_the_put(s3, puts):
+    png = qrcodes.render_qr_png("http://localhost/xyz")
+    AWShelper.upload_qr_to_s3(png)
+    AWShelper.upload_qr_to_s3(png)
+    assert puts == [f"qr/{hashlib.sha256(png).hexdigest()}.png"]
+
+def test_link_qr_is_rendered_once(s3, puts, renders):
+    link = database_models.Links(short_code="abc")
+
+    png = asyncio.run(qrcodes.ensure_link_qr(link, "http://localhost/abc"))
+    path = link.qr_code_path
+    assert png is not None and path == AWShelper.s3_public_url(f"qr/{hashlib.sha256(png).hexdigest()}.png")
+
+    # What get_link_qrcode does on the next request: the stored path is returned as-is
+    assert asyncio.run(qrcodes.ensure_link_qr(link, "http://localhost/abc")) is None
+    assert link.qr_code_path == path
+    assert renders == ["http://localhost/abc"]
+    assert len(puts) == 1
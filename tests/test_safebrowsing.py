@@ -0,0 +1,169 @@
+"""
+Safe Browsing batching and the verdict cache against stub APIs served through httpx.MockTransport.
+"""
+import asyncio
+import json
+import re
+import fakeredis
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from security import safebrowsing
+
+SAFE_BROWSING_STUB = "https://safebrowsing.stub/v4/threatMatches:find"
+
+class StubAPIs:
+    """
+    Answers threatMatches:find and chat completions. URLs in `threats` are Safe Browsing
+    matches, URLs in `spam` are classified as spam; `failing` makes Safe Browsing return 503.
+    """
+    def __init__(self):
+        self.threats: set[str] = set()
+        self.spam: set[str] = set()
+        self.failing = False
+        self.lookups: list[list[str]] = []
+        self.classified: list[str] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        if request.url.host == "safebrowsing.stub":
+            urls = [entry["url"] for entry in body["threatInfo"]["threatEntries"]]
+            self.lookups.append(urls)
+            if self.failing:
+                return httpx.Response(503)
+            matches = [{"threatType": "MALWARE", "threat": {"url": url}} for url in urls if url in self.threats]
+            return httpx.Response(200, json={"matches": matches} if matches else {})
+        url = re.search(r"URL: (\S+)", body["messages"][0]["content"]).group(1)  # type: ignore
+        self.classified.append(url)
+        category = "spam" if url in self.spam else "safe"
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": json.dumps({"category": category, "reason": "stub"})},
+            }],
+        })
+
+@pytest.fixture
+def stub():
+    return StubAPIs()
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def run(stub: StubAPIs, server, coro_fn, window: float = 0.01, max_entries: int = 500):
+    """
+    Run coro_fn() with the module's HTTP, OpenAI and Redis clients pointed at the stubs.
+    The clients are made inside the event loop that uses them.
+    """
+    async def main():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(stub.handle))
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(safebrowsing, "SAFE_BROWSING_URL", SAFE_BROWSING_STUB)
+            mp.setattr(safebrowsing, "get_http_client", lambda: http)
+            mp.setattr(safebrowsing, "_openai",
+                       AsyncOpenAI(api_key="stub", base_url="https://openai.stub/v1", http_client=http))
+            mp.setattr(safebrowsing, "async_redis_client",
+                       fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+            mp.setattr(safebrowsing, "safe_browsing_batcher", safebrowsing.SafeBrowsingBatcher(window, max_entries))
+            try:
+                return await coro_fn()
+            finally:
+                await http.aclose()
+    return asyncio.run(main())
+
+def test_concurrent_lookups_share_one_request(stub, server):
+    stub.threats.add("https://bad.example/")
+
+    async def lookups():
+        batcher = safebrowsing.safe_browsing_batcher
+        urls = ["https://a.example/", "https://bad.example/", "https://a.example/", "https://b.example/"]
+        return await asyncio.gather(*(batcher.check(url) for url in urls))
+
+    results = run(stub, server, lookups)
+    assert len(stub.lookups) == 1
+    assert sorted(stub.lookups[0]) == ["https://a.example/", "https://b.example/", "https://bad.example/"]
+    assert results[0] is None and results[2] is None and results[3] is None
+    assert results[1][0]["threat"]["url"] == "https://bad.example/"
+
+def test_full_batch_is_sent_without_waiting(stub, server):
+    async def lookups():
+        batcher = safebrowsing.safe_browsing_batcher
+        return await asyncio.gather(*(batcher.check(f"https://{i}.example/") for i in range(4)))
+
+    # A window this long would time the test out if full batches waited for it
+    results = run(stub, server, lookups, window=60, max_entries=2)
+    assert results == [None] * 4
+    assert [len(urls) for urls in stub.lookups] == [2, 2]
+
+def test_failed_request_reaches_every_caller(stub, server):
+    stub.failing = True
+
+    async def lookups():
+        batcher = safebrowsing.safe_browsing_batcher
+        return await asyncio.gather(*(batcher.check(f"https://{i}.example/") for i in range(3)),
+                                    return_exceptions=True)
+
+    results = run(stub, server, lookups)
+    assert len(stub.lookups) == 1
+    assert all(isinstance(result, httpx.HTTPStatusError) for result in results)
+
+def test_url_verdicts_are_cached(stub, server):
+    stub.spam.add("https://spam.example/offer")
+
+    async def checks():
+        first = await asyncio.gather(safebrowsing.check_url_safety("https://ok.example/page"),
+                                     safebrowsing.check_url_safety("https://spam.example/offer"))
+        again = await asyncio.gather(safebrowsing.check_url_safety("HTTPS://OK.example/page"),
+                                     safebrowsing.check_url_safety("https://spam.example/offer"))
+        return first, again
+
+    first, again = run(stub, server, checks)
+    assert first == again == ["safe", "spam"]
+    # URL and domain entries of both checks went out together, and nothing after the cache filled
+    assert len(stub.lookups) == 1 and len(stub.lookups[0]) == 4
+    assert len(stub.classified) == 2
+    redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+    assert redis.ttl(safebrowsing.url_verdict_key("https://ok.example/page")) <= safebrowsing.SAFE_VERDICT_TTL_SECONDS
+    assert redis.ttl(safebrowsing.url_verdict_key("https://spam.example/offer")) > safebrowsing.SAFE_VERDICT_TTL_SECONDS
+
+def test_threat_domain_covers_its_other_urls(stub, server):
+    stub.threats.add("http://evil.example/")
+
+    async def checks():
+        first = await safebrowsing.check_url_safety("https://evil.example/one")
+        second = await safebrowsing.check_url_safety("https://evil.example/two")
+        return first, second
+
+    assert run(stub, server, checks) == ("threat", "threat")
+    # The second URL was answered from the domain verdict
+    assert len(stub.lookups) == 1
+    assert stub.classified == ["https://evil.example/one"]
+
+def test_safe_domain_is_not_looked_up_again(stub, server):
+    async def checks():
+        await safebrowsing.check_url_safety("https://fine.example/one")
+        await safebrowsing.check_url_safety("https://fine.example/two")
+
+    run(stub, server, checks)
+    assert [sorted(urls) for urls in stub.lookups] == [
+        ["http://fine.example/", "https://fine.example/one"], ["https://fine.example/two"]]
+
+def test_failed_checks_are_not_cached(stub, server):
+    stub.failing = True
+
+    async def failing_check():
+        with pytest.raises(httpx.HTTPStatusError):
+            await safebrowsing.check_url_safety("https://flaky.example/")
+
+    run(stub, server, failing_check)
+    assert fakeredis.FakeRedis(server=server).keys("safety:*") == []
+
+    stub.failing = False
+    assert run(stub, server, lambda: safebrowsing.check_url_safety("https://flaky.example/")) == "safe"
+    assert len(stub.lookups) == 2
@@ -1,6 +1,8 @@
 from io import BytesIO
+import hashlib
 import qrcode
 import boto3
+from botocore.exceptions import ClientError
 import os
 
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
@@ -8,10 +10,14 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-2")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME", "linkbottle-bucket")
 SES_FROM_EMAIL= os.getenv("SES_FROM_EMAIL")
+# Points S3 at a stand-in such as moto_server or LocalStack
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL") or None
+AWS_SES_ENDPOINT_URL = os.getenv("AWS_SES_ENDPOINT_URL") or None
 
 s3 = boto3.client(
     "s3",
     region_name=AWS_REGION,
+    endpoint_url=AWS_S3_ENDPOINT_URL,
     aws_access_key_id=AWS_ACCESS_KEY,
     aws_secret_access_key=AWS_SECRET_KEY,
 )
@@ -35,22 +41,43 @@ def generate_qr_code(data: str) -> BytesIO:
     byte_io.seek(0)
     return byte_io
 
-def upload_qr_to_s3(key: str, png_bytes: bytes) -> str:
-    s3_key = f"qr/{key}.png"
+def s3_public_url(s3_key: str) -> str:
+    if AWS_S3_ENDPOINT_URL:
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{AWS_BUCKET_NAME}/{s3_key}"
+    return f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
 
-    s3.put_object(
-        Bucket=AWS_BUCKET_NAME,
-        Key=s3_key,
-        Body=png_bytes,
-        ContentType="image/png",
-    )
+def s3_object_exists(s3_key: str) -> bool:
+    try:
+        s3.head_object(Bucket=AWS_BUCKET_NAME, Key=s3_key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+def upload_qr_to_s3(png_bytes: bytes) -> str:
+    """
+    Store the PNG under its content hash, so an identical image is only uploaded once.
+    """
+    s3_key = f"qr/{hashlib.sha256(png_bytes).hexdigest()}.png"
+
+    if not s3_object_exists(s3_key):
+        s3.put_object(
+            Bucket=AWS_BUCKET_NAME,
+            Key=s3_key,
+            Body=png_bytes,
+            ContentType="image/png",
+            # The content never changes under a given key
+            CacheControl="public, max-age=31536000, immutable",
+        )
 
     # Return the public URL
-    return f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+    return s3_public_url(s3_key)
 
 ses = boto3.client(
     "ses",
     region_name=AWS_REGION,
+    endpoint_url=AWS_SES_ENDPOINT_URL,
     aws_access_key_id=AWS_ACCESS_KEY,
     aws_secret_access_key=AWS_SECRET_KEY,
 )
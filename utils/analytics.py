@@ -0,0 +1,68 @@
+import re
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from starlette.datastructures import Headers
+
+# Checked in order; the first header present wins
+COUNTRY_HEADERS = ("cf-ipcountry", "cloudfront-viewer-country", "x-appengine-country", "x-country-code")
+
+GRANULARITIES = ("minute", "hour", "day")
+
+# Order matters: Edge and Opera also advertise Chrome, Chrome also advertises Safari
+_UA_FAMILIES = (
+    ("Bot", re.compile(r"bot|crawler|spider|slurp|preview", re.I)),
+    ("Edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("Opera", re.compile(r"OPR/|Opera")),
+    ("Samsung Internet", re.compile(r"SamsungBrowser/")),
+    ("Chrome", re.compile(r"Chrome/|CriOS/")),
+    ("Firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("Safari", re.compile(r"Safari/")),
+    ("curl", re.compile(r"^curl/")),
+    ("Python", re.compile(r"python-requests|python-httpx|aiohttp|urllib", re.I)),
+)
+
+def ua_family(user_agent: str) -> str:
+    if not user_agent:
+        return ""
+    for family, pattern in _UA_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return "Other"
+
+def referrer_host(referrer: str) -> str:
+    # Only the host is kept so the breakdown has bounded cardinality
+    if not referrer:
+        return ""
+    return (urlsplit(referrer).hostname or "")[:255]
+
+def click_context(headers: Headers) -> dict[str, str]:
+    """
+    Fields recorded with every click event; empty strings mean unknown.
+    """
+    country = next((headers[h] for h in COUNTRY_HEADERS if h in headers), "").strip().upper()[:2]
+    return {
+        "referrer": referrer_host(headers.get("referer", "")),
+        "ua": ua_family(headers.get("user-agent", "")),
+        # XX and T1 are what CDNs send for unknown and Tor traffic
+        "country": "" if country in ("XX", "T1") else country,
+    }
+
+def entry_time(entry_id: str) -> datetime:
+    """
+    Naive UTC time of a click, taken from the millisecond timestamp Redis put in the entry id.
+    """
+    ms = int(entry_id.split("-", 1)[0])
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+def to_naive_utc(ts: datetime) -> datetime:
+    # Analytics tables store naive UTC so comparisons don't depend on the session time zone
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -0,0 +1,68 @@
+import hashlib
+import math
+import threading
+from typing import Iterable, Optional
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings using double hashing of one blake2b digest.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class RebuildableBloomFilter:
+    """
+    Bloom filter that can be rebuilt from a full key listing while live adds continue.
+    Until the first build completes every key is reported as possibly present.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current: Optional[BloomFilter] = None
+        self._building: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._current is not None
+
+    def might_contain(self, item: str) -> bool:
+        current = self._current
+        return current is None or item in current
+
+    def add(self, *items: str) -> None:
+        with self._lock:
+            for bloom in (self._current, self._building):
+                if bloom is None:
+                    continue
+                for item in items:
+                    bloom.add(item)
+
+    def rebuild(self, items: Iterable[str], expected: int = 0) -> None:
+        # Size for twice the current population so growth doesn't degrade it before the next rebuild
+        bloom = BloomFilter(max(self.capacity, expected * 2), self.error_rate)
+        with self._lock:
+            self._building = bloom
+        for item in items:
+            # Bit updates are read-modify-write, so they share the lock with live adds
+            with self._lock:
+                bloom.add(item)
+        with self._lock:
+            self._current = bloom
+            self._building = None
@@ -0,0 +1,58 @@
+from utils.database import async_redis_client, AsyncRedis
+
+# One entry per click, consumed by click_worker through a consumer group
+CLICK_STREAM_KEY = "click_events"
+
+# Per-link counters and their dirty set, only read to drain clicks recorded before the stream
+DIRTY_SET_KEY = "click_dirty_links"
+CLICK_COUNTER_PREFIX = "click_count:"
+
+# Returned instead of a link when the key is in the negative cache
+LINK_MISSING = "missing"
+
+# Resolves a cached link and records the click in one round trip; pending or blocked
+# links return their status and are not counted.
+# KEYS[1] = cached link entry, KEYS[2] = click stream, KEYS[3] = negative cache entry,
+# ARGV = extra field/value pairs stored with the click event
+REDIRECT_SCRIPT = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    if redis.call('EXISTS', KEYS[3]) == 1 then
+        return 0
+    end
+    return false
+end
+local link = cjson.decode(raw)
+local status = link['status']
+if type(status) == 'string' and status ~= 'active' then
+    return status
+end
+local link_id = tostring(link['id'])
+redis.call('XADD', KEYS[2], '*', 'link_id', link_id, unpack(ARGV))
+return {link_id, link['original_url']}
+"""
+redirect_script = async_redis_client.register_script(REDIRECT_SCRIPT)
+
+async def resolve_cached_click(redis: AsyncRedis, cache_key: str, missing_key: str,
+                               context: dict[str, str]):
+    """
+    Returns (link_id, original_url) of a cached link and counts the click,
+    LINK_MISSING if the key is known not to exist, the link's status if it isn't active,
+    or None if it is not cached.
+    """
+    fields = [v for item in context.items() for v in item]
+    result = await redirect_script(keys=[cache_key, CLICK_STREAM_KEY, missing_key], args=fields,
+                                   client=redis)
+    if result == 0:
+        return LINK_MISSING
+    if not result:
+        return None
+    if isinstance(result, str):
+        return result
+    return int(result[0]), result[1]
+
+def record_click(pipe, link_id: int, context: dict[str, str]) -> None:
+    """
+    Queue the click event on an existing pipeline.
+    """
+    pipe.xadd(CLICK_STREAM_KEY, {"link_id": link_id, **context})
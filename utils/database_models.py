@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Float, ForeignKey, Boolean, TIMESTAMP, ARRAY
+from sqlalchemy import Integer, BigInteger, String, Float, ForeignKey, Boolean, TIMESTAMP, ARRAY, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import mapped_column
 
@@ -21,6 +21,13 @@ class Users(Base):
     github_id = mapped_column(String, unique=True, nullable=True)
 
 
+# Links.status; links created in async enrichment mode stay pending until their safety check lands
+LINK_PENDING = "pending"
+LINK_ACTIVE = "active"
+LINK_BLOCKED = "blocked"
+# Enrichment kept failing; the link never got a safety verdict and is not served
+LINK_FAILED = "failed"
+
 class Links(Base):
 
     __tablename__ = "links"
@@ -30,10 +37,13 @@ class Links(Base):
     alias =  mapped_column(String, nullable=True, unique=True)
     title =  mapped_column(String)
     original_url =  mapped_column(String, nullable=False)
+    # utils.urls.url_hash(original_url); dedup lookups go through its index
+    url_hash =  mapped_column(String, nullable=True, index=True)
     short_url =  mapped_column(String, unique=True, nullable=False)
     created_at =  mapped_column(TIMESTAMP)
     clicks =  mapped_column(Integer, default=0)
     qr_code_path =  mapped_column(String, nullable=True)
+    status =  mapped_column(String, nullable=False, default=LINK_ACTIVE, server_default=LINK_ACTIVE)
     
 
 class userLinks(Base):
@@ -48,3 +58,37 @@ class userLinks(Base):
     tags =  mapped_column(ARRAY(String))
 
     _unique_constraint_ = ('user_id', 'link_id')
+
+
+class ClickFlushBatches(Base):
+
+    __tablename__ = "click_flush_batches"
+
+    # One row per click batch applied to links.clicks; makes replaying a batch a no-op
+    id =  mapped_column(String, primary_key=True)
+    applied_at =  mapped_column(TIMESTAMP, nullable=False, index=True)
+
+
+class ClickEvents(Base):
+
+    __tablename__ = "click_events"
+
+    id =  mapped_column(BigInteger, primary_key=True)
+    link_id =  mapped_column(Integer, ForeignKey('links.id', ondelete="CASCADE"), nullable=False)
+    clicked_at =  mapped_column(TIMESTAMP, nullable=False)
+    referrer =  mapped_column(String, nullable=True)
+    ua_family =  mapped_column(String, nullable=True)
+    country =  mapped_column(String, nullable=True)
+
+    __table_args__ = (Index('ix_click_events_link_id_clicked_at', 'link_id', 'clicked_at'),)
+
+
+class LinkClickRollups(Base):
+
+    __tablename__ = "link_click_rollups"
+
+    # granularity is 'minute', 'hour' or 'day'; bucket_start is the UTC start of the bucket
+    link_id =  mapped_column(Integer, ForeignKey('links.id', ondelete="CASCADE"), primary_key=True)
+    granularity =  mapped_column(String, primary_key=True)
+    bucket_start =  mapped_column(TIMESTAMP, primary_key=True)
+    clicks =  mapped_column(Integer, nullable=False, default=0)
@@ -0,0 +1,51 @@
+import json
+import os
+import smtplib
+from email.message import EmailMessage
+from string import Template
+from redis.asyncio import Redis as AsyncRedis
+from utils.AWShelper import send_email, SES_FROM_EMAIL
+
+# Outgoing mail waits here for email_worker.py
+EMAIL_QUEUE_KEY = "email_outbox"
+# Failed sends, scored by the time they may be retried
+EMAIL_RETRY_KEY = "email_retry"
+EMAIL_PROCESSING_PREFIX = "email_outbox:processing:"
+EMAIL_ALIVE_PREFIX = "email_outbox:alive:"
+
+# "ses" sends through AWS SES; "smtp" talks to SMTP_HOST, e.g. a local MailHog or aiosmtpd stub
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "ses")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+
+EMAIL_TEMPLATES = {
+    "otp": (
+        Template("Your LinkBottle account's One Time Passcode"),
+        Template("Your One Time Passcode is: \n $code"),
+    ),
+}
+
+def render_email(template: str, params: dict) -> tuple[str, str]:
+    subject, body = EMAIL_TEMPLATES[template]
+    return subject.substitute(params), body.substitute(params)
+
+async def enqueue_email(redis: AsyncRedis, to: str, template: str, **params) -> None:
+    # Render now so a bad template fails the request rather than the worker
+    render_email(template, params)
+    await redis.lpush(EMAIL_QUEUE_KEY, json.dumps({"to": to, "template": template, "params": params, "attempts": 0}))
+
+def send_smtp(to: str, subject: str, body: str) -> None:
+    message = EmailMessage()
+    message["From"] = SES_FROM_EMAIL or "noreply@localhost"
+    message["To"] = to
+    message["Subject"] = subject
+    message.set_content(body)
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as smtp:
+        smtp.send_message(message)
+
+def deliver(to: str, template: str, params: dict) -> None:
+    subject, body = render_email(template, params)
+    if EMAIL_BACKEND == "smtp":
+        send_smtp(to, subject, body)
+    else:
+        send_email(to, subject, body)
@@ -0,0 +1,20 @@
+import json
+import os
+from redis import Redis
+
+# When enabled, new links are stored as pending and enrichment_worker fills in
+# the safety verdict, title and QR code instead of the request doing it inline
+ASYNC_LINK_ENRICHMENT = os.getenv("ASYNC_LINK_ENRICHMENT", "false").lower() == "true"
+
+ENRICHMENT_QUEUE_KEY = "link_enrichment"
+# Jobs a worker task is handling, so they survive the worker dying mid-job
+ENRICHMENT_PROCESSING_PREFIX = "link_enrichment:processing:"
+ENRICHMENT_ALIVE_PREFIX = "link_enrichment:alive:"
+# Failed jobs, scored by the time they may be retried
+ENRICHMENT_RETRY_KEY = "link_enrichment:retry"
+
+# Seconds a client should wait before retrying the redirect of a pending link
+PENDING_RETRY_AFTER_SECONDS = 5
+
+def enqueue_enrichment(redis: Redis, link_id: int, generate_qr: bool = False) -> None:
+    redis.lpush(ENRICHMENT_QUEUE_KEY, json.dumps({"link_id": link_id, "generate_qr": generate_qr, "attempts": 0}))
@@ -0,0 +1,58 @@
+import csv
+import io
+import json
+from typing import IO, Iterator, Optional
+
+IMPORT_FORMATS = ("csv", "ndjson")
+CONTENT_TYPE_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/ndjson": "ndjson",
+}
+
+IMPORT_JOB_TTL_SECONDS = 24 * 3600
+# Row errors kept per job; later ones are only counted
+IMPORT_MAX_ERRORS = 100
+
+def import_job_key(job_id: str) -> str:
+    return f"import_job:{job_id}"
+
+def import_errors_key(job_id: str) -> str:
+    return f"import_job:{job_id}:errors"
+
+def import_format(requested: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    if requested:
+        return requested if requested in IMPORT_FORMATS else None
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    return CONTENT_TYPE_FORMATS.get(media_type)
+
+def iter_rows(spool: IO[bytes], fmt: str) -> Iterator[tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Yields (line number, row, error) for each record of a spooled upload, one at a time.
+    CSV needs a header row; blank NDJSON lines are skipped.
+    """
+    spool.seek(0)
+    text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            for row in reader:
+                # Empty cells mean "not given" rather than an empty string
+                yield reader.line_num, {k: v for k, v in row.items() if k and v not in (None, "")}, None
+        else:
+            for line_no, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_no, None, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_no, None, "Each line must be a JSON object"
+                    continue
+                yield line_no, row, None
+    finally:
+        # Leave closing the spool to the caller
+        text.detach()
@@ -0,0 +1,43 @@
+import json
+from typing import Callable, Optional
+from redis import Redis
+from redis.client import PubSubWorkerThread
+from utils.database import redis_client
+
+# Single channel shared by every worker; messages are routed by their "event" field
+INVALIDATION_CHANNEL = "linkbottle:invalidate"
+
+_handlers: dict[str, list[Callable[[dict], None]]] = {}
+_listener: Optional[PubSubWorkerThread] = None
+
+def subscribe(event: str, handler: Callable[[dict], None]) -> None:
+    _handlers.setdefault(event, []).append(handler)
+
+def publish(redis: Redis, event: str, **payload) -> None:
+    redis.publish(INVALIDATION_CHANNEL, json.dumps({"event": event, **payload}))
+
+def _dispatch(message: dict) -> None:
+    try:
+        data = json.loads(message["data"])
+    except (TypeError, ValueError):
+        return
+    for handler in _handlers.get(data.get("event"), []):
+        handler(data)
+
+def start_listener() -> None:
+    """
+    Start the background thread that applies invalidations published by other workers.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{INVALIDATION_CHANNEL: _dispatch})
+    _listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+def stop_listener() -> None:
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
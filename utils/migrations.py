@@ -0,0 +1,91 @@
+import logging
+from sqlalchemy import Engine, text
+from utils.urls import url_hash
+
+logger = logging.getLogger(__name__)
+
+# create_all only creates missing tables; columns added to existing ones go here.
+# Every statement must be safe to run on each startup.
+MIGRATIONS = [
+    "ALTER TABLE links ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'active'",
+    # Counter behind utils.shortcodes
+    "CREATE SEQUENCE IF NOT EXISTS short_code_seq",
+    "ALTER TABLE links ADD COLUMN IF NOT EXISTS url_hash VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_links_url_hash ON links (url_hash)",
+]
+
+BACKFILL_BATCH_SIZE = 1000
+
+def backfill_url_hashes(engine: Engine) -> None:
+    # One short transaction per batch so a large table isn't locked for the whole run
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, original_url FROM links WHERE url_hash IS NULL AND id > :last_id "
+                "ORDER BY id LIMIT :n"), {"last_id": last_id, "n": BACKFILL_BATCH_SIZE}).all()
+            if not rows:
+                return
+            conn.execute(text("UPDATE links SET url_hash = :hash WHERE id = :id"),
+                         [{"id": row.id, "hash": url_hash(row.original_url)} for row in rows])
+        last_id = rows[-1].id
+
+def rehash_fragment_urls(engine: Engine) -> None:
+    # Hashes written before the fragment became part of the dedup key
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, original_url, url_hash FROM links WHERE original_url LIKE '%#%' AND id > :last_id "
+                "ORDER BY id LIMIT :n"), {"last_id": last_id, "n": BACKFILL_BATCH_SIZE}).all()
+            if not rows:
+                return
+            stale = [{"id": row.id, "hash": url_hash(row.original_url)} for row in rows
+                     if row.url_hash and row.url_hash != url_hash(row.original_url)]
+            if stale:
+                conn.execute(text("UPDATE links SET url_hash = :hash WHERE id = :id"), stale)
+        last_id = rows[-1].id
+
+# Data migrations that can't be written in SQL; each is a no-op once done.
+# They walk whole tables, so they run once per deploy through `python -m utils.migrations`
+# instead of in every process on startup.
+BACKFILLS = [
+    backfill_url_hashes,
+    rehash_fragment_urls,
+]
+
+# Arbitrary advisory lock keys
+MIGRATION_LOCK_ID = 7_201_750
+# Held while backfilling, so two deploy jobs don't backfill the same rows
+BACKFILL_LOCK_ID = 7_201_751
+
+def run_migrations(engine: Engine) -> None:
+    with engine.begin() as conn:
+        # Uvicorn workers start together; IF NOT EXISTS alone can still race on the catalog
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+
+def run_backfills(engine: Engine) -> bool:
+    """
+    Returns False without doing anything if another process holds the backfill lock.
+    """
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": BACKFILL_LOCK_ID}).scalar():
+            return False
+        try:
+            for backfill in BACKFILLS:
+                logger.info("Running %s", backfill.__name__)
+                backfill(engine)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": BACKFILL_LOCK_ID})
+    return True
+
+if __name__ == "__main__":
+    from utils import database_models
+    from utils.database import engine
+    logging.basicConfig(level=logging.INFO)
+    database_models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    if not run_backfills(engine):
+        logger.warning("Another process is already running the backfills")
@@ -0,0 +1,78 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional
+import qrcode
+import qrcode.image.svg
+from PIL import Image
+from utils import database_models
+from utils.AWShelper import generate_qr_code, upload_qr_to_s3
+
+# PIL rendering is CPU-bound and holds the GIL, so it runs in worker processes
+QR_RENDER_PROCESSES = int(os.getenv("QR_RENDER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_qr_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=QR_RENDER_PROCESSES)
+    return _pool
+
+def shutdown_qr_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+def render_qr_png(data: str) -> bytes:
+    return generate_qr_code(data).getvalue()
+
+# Pixel sizes offered for PNG downloads, so every variant can be cached
+QR_SIZES = (128, 256, 512, 1024)
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+def render_qr_variant(data: str, fmt: str, size: Optional[int]) -> bytes:
+    """
+    PNG at its natural size (the one stored in S3) or scaled to `size` pixels, or SVG.
+    """
+    if fmt == "png" and size is None:
+        return render_qr_png(data)
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)  # type: ignore
+    qr.add_data(data)
+    qr.make(fit=True)
+    byte_io = BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(byte_io)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white").get_image()  # type: ignore
+        img.resize((size, size), Image.Resampling.NEAREST).save(byte_io, format="PNG")
+    return byte_io.getvalue()
+
+async def render_qr_bytes(data: str, fmt: str, size: Optional[int]) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(get_qr_pool(), render_qr_variant, data, fmt, size)
+
+async def render_qr(data: str) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(get_qr_pool(), render_qr_png, data)
+
+async def store_qr(png: bytes) -> str:
+    # boto3 is blocking; keep it off the event loop. upload_qr_to_s3 skips images already stored.
+    return await asyncio.to_thread(upload_qr_to_s3, png)
+
+async def create_qr(data: str) -> tuple[bytes, str]:
+    """
+    Render a QR code for `data` and store it. Returns the PNG and its public URL.
+    """
+    png = await render_qr(data)
+    return png, await store_qr(png)
+
+async def ensure_link_qr(link: database_models.Links, data: str) -> Optional[bytes]:
+    """
+    Give `link` a stored QR code for `data` unless it already has one.
+    Returns the newly rendered PNG, or None if the existing code was kept.
+    """
+    if link.qr_code_path:
+        return None
+    png, link.qr_code_path = await create_qr(data)
+    return png
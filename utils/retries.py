@@ -0,0 +1,16 @@
+import random
+
+# Moves jobs whose retry time has come from a sorted set (scored by that time) back onto
+# a queue list, atomically so two workers can't both take one
+PROMOTE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+def retry_delay(attempts: int, base: float, cap: float) -> float:
+    # Exponential backoff with jitter so a burst of failures doesn't retry in lockstep
+    return min(base * 2 ** attempts, cap) * random.uniform(0.5, 1.0)
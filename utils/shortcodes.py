@@ -0,0 +1,179 @@
+"""
+Short code allocation.
+
+Codes come from a counter (a Postgres sequence or Redis) passed through a keyed
+Feistel permutation of the base62 space, so they are unique by construction and
+don't reveal how many links exist. No lookups are needed before the INSERT.
+"""
+import hashlib
+import os
+import random
+import string
+import threading
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from redis import Redis
+
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+
+# random | sequence | block | redis
+SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "block")
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "6"))
+# Share of each length's code space handed out before moving to the next length;
+# below 1.0 keeps codes sparse and hard to guess
+SHORT_CODE_MAX_FILL = float(os.getenv("SHORT_CODE_MAX_FILL", "1.0"))
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+# Keys the permutation; changing it on a live database can produce duplicate codes
+SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "linkbottle")
+
+SEQUENCE_NAME = "short_code_seq"
+REDIS_COUNTER_KEY = "short_code_seq"
+
+FEISTEL_ROUNDS = 4
+
+def encode(n: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        n, r = divmod(n, BASE)
+        chars.append(ALPHABET[r])
+    return "".join(reversed(chars))
+
+class FeistelPermutation:
+    """
+    Keyed bijection on range(size). A balanced Feistel network over the smallest
+    even bit width that covers `size`, cycle-walking values that land outside it.
+    """
+    def __init__(self, size: int, key: str):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [f"{key}:{size}:{i}".encode() for i in range(FEISTEL_ROUNDS)]
+
+    def _round(self, i: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "big"), key=self.keys[i][:64], digest_size=8).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def _encrypt(self, n: int) -> int:
+        left, right = n >> self.half, n & self.mask
+        for i in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half) | right
+
+    def __call__(self, n: int) -> int:
+        if not 0 <= n < self.size:
+            raise ValueError("index out of range")
+        # The network permutes 2^bits values; walking the cycle keeps the result in range
+        n = self._encrypt(n)
+        while n >= self.size:
+            n = self._encrypt(n)
+        return n
+
+class CodeSpace:
+    """
+    Maps the n-th allocation to a code, growing the length once a length's share is used up.
+    """
+    def __init__(self, min_length: int, max_fill: float, key: str):
+        self.min_length = min_length
+        self.max_fill = max_fill
+        self.key = key
+        self._permutations: dict[int, FeistelPermutation] = {}
+
+    def permutation(self, length: int) -> FeistelPermutation:
+        perm = self._permutations.get(length)
+        if perm is None:
+            perm = self._permutations[length] = FeistelPermutation(BASE ** length, self.key)
+        return perm
+
+    def code(self, n: int) -> str:
+        length = self.min_length
+        while True:
+            usable = max(int(BASE ** length * self.max_fill), 1)
+            if n < usable:
+                return encode(self.permutation(length)(n), length)
+            n -= usable
+            length += 1
+
+class RandomAllocator:
+    """
+    The original scheme: random codes, relying on the unique index to catch repeats.
+    """
+    def __init__(self, length: int):
+        self.length = length
+
+    def allocate(self, db: Session) -> str:
+        return "".join(random.choice(ALPHABET) for _ in range(self.length))
+
+class SequenceAllocator:
+    """
+    One counter value per code; `block_size` > 1 leases that many values per round trip.
+    """
+    def __init__(self, space: CodeSpace, counter: str, block_size: int = 1,
+                 redis: Optional[Redis] = None):
+        self.space = space
+        self.counter = counter
+        self.block_size = block_size
+        self.redis = redis
+        self._lock = threading.Lock()
+        self._leased: list[int] = []
+
+    def lease(self, db: Session, count: int) -> list[int]:
+        if self.counter == "redis":
+            assert self.redis is not None
+            end = int(self.redis.incrby(REDIS_COUNTER_KEY, count))
+            return list(range(end - count, end))
+        # Sequence values are never handed out twice, even to concurrent transactions
+        rows = db.execute(text(f"SELECT nextval('{SEQUENCE_NAME}') FROM generate_series(1, :n)"),
+                          {"n": count})
+        return [row[0] - 1 for row in rows]
+
+    def allocate(self, db: Session) -> str:
+        with self._lock:
+            if not self._leased:
+                # Reversed so pop() hands them out in order
+                self._leased = self.lease(db, self.block_size)[::-1]
+            n = self._leased.pop()
+        return self.space.code(n)
+
+def make_allocator(kind: str = SHORT_CODE_ALLOCATOR, redis: Optional[Redis] = None):
+    if kind == "random":
+        return RandomAllocator(SHORT_CODE_LENGTH)
+    space = CodeSpace(SHORT_CODE_LENGTH, SHORT_CODE_MAX_FILL, SHORT_CODE_SECRET)
+    if kind == "sequence":
+        return SequenceAllocator(space, "postgres")
+    if kind == "block":
+        return SequenceAllocator(space, "postgres", SHORT_CODE_BLOCK_SIZE)
+    if kind == "redis":
+        return SequenceAllocator(space, "redis", SHORT_CODE_BLOCK_SIZE, redis)
+    raise ValueError(f"Unknown SHORT_CODE_ALLOCATOR {kind!r}")
+
+if __name__ == "__main__":
+    # Allocation throughput: python -m utils.shortcodes [count] [allocator ...]
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    kinds = sys.argv[2:] or ["random", "permutation"]
+
+    for kind in kinds:
+        if kind == "permutation":
+            # Pure CPU cost of turning counter values into codes
+            space = CodeSpace(SHORT_CODE_LENGTH, SHORT_CODE_MAX_FILL, SHORT_CODE_SECRET)
+            start = time.perf_counter()
+            codes = {space.code(n) for n in range(count)}
+            assert len(codes) == count
+        else:
+            from utils.database import sessionLocal, redis_client
+            allocator = make_allocator(kind, redis_client)
+            db = sessionLocal()
+            try:
+                start = time.perf_counter()
+                for _ in range(count):
+                    allocator.allocate(db)
+            finally:
+                db.rollback()
+                db.close()
+        elapsed = time.perf_counter() - start
+        print(f"{kind:12} {count / elapsed:12,.0f} codes/s")
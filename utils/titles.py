@@ -0,0 +1,82 @@
+import codecs
+import hashlib
+import os
+from html.parser import HTMLParser
+from typing import Optional
+import httpx
+from utils.database import async_redis_client
+from utils.http import get_http_client
+from utils.urls import normalize_url
+
+# Stop reading a page after this many bytes if no </title> showed up
+TITLE_MAX_BYTES = int(os.getenv("TITLE_MAX_BYTES", str(64 * 1024)))
+TITLE_CACHE_TTL_SECONDS = 24 * 3600
+TITLE_MAX_LENGTH = 300
+
+FETCH_FAILED = "Failed to Fetch Title"
+NO_TITLE = "No Title"
+
+class TitleParser(HTMLParser):
+    """
+    Incremental parser that collects the first <title> and reports when it is closed.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_title = False
+        self.done = False
+        self.parts: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.done:
+            self.in_title = True
+        elif tag == "body":
+            # No title in <head>; a <title> further down belongs to svg etc.
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.parts.append(data)
+
+    @property
+    def title(self) -> Optional[str]:
+        title = " ".join("".join(self.parts).split())
+        return title[:TITLE_MAX_LENGTH] or None
+
+def title_cache_key(url: str) -> str:
+    return f"title:{hashlib.sha256(normalize_url(url).encode()).hexdigest()}"
+
+async def read_title(url: str) -> str:
+    """
+    Streams the page and stops at </title> or TITLE_MAX_BYTES.
+    """
+    try:
+        async with get_http_client().stream("GET", url, follow_redirects=True) as resp:
+            if resp.status_code != 200:
+                return FETCH_FAILED
+            decoder = codecs.getincrementaldecoder(resp.charset_encoding or "utf-8")(errors="replace")
+            parser = TitleParser()
+            received = 0
+            async for chunk in resp.aiter_bytes():
+                received += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if parser.done or received >= TITLE_MAX_BYTES:
+                    break
+    except (httpx.HTTPError, LookupError):
+        return FETCH_FAILED
+    return parser.title or NO_TITLE
+
+async def fetch_title(url: str) -> str:
+    key = title_cache_key(url)
+    cached = await async_redis_client.get(key)
+    if cached is not None:
+        return cached
+    title = await read_title(url)
+    # Failures are usually transient; don't pin them
+    if title != FETCH_FAILED:
+        await async_redis_client.set(key, title, ex=TITLE_CACHE_TTL_SECONDS)
+    return title
@@ -0,0 +1,33 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL: lower-case scheme and host, no default port,
+    an explicit "/" path and query parameters in sorted order. The fragment is kept
+    as-is, since single-page apps route on it.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, parts.fragment))
+
+def url_domain(url: str) -> str:
+    return (urlsplit(url.strip()).hostname or "").rstrip(".")
+
+def url_hash(url: str) -> str:
+    """
+    Dedup key of a URL; equal for URLs that only differ in spelling.
+    """
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
@@ -0,0 +1,181 @@
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+from redis import Redis
+from utils.database import redis_client
+
+# Per-user index of the /links list, kept up to date in place on every mutation:
+#   order: sorted set (all scores 0) of "{created_us:016d}:{user_link_id:012d}" members,
+#          so lexicographic order is (created_at, user_link_id) and keyset paging is one ZRANGE BYLEX
+#   views: hash of user_link_id -> user_link_view_dict JSON
+#   ready: present once the index holds the user's complete list
+INDEX_TTL_SECONDS = 7 * 24 * 3600
+BUILD_LOCK_SECONDS = 60
+BUILD_BATCH = 1000
+
+def order_key(user_id: int) -> str:
+    return f"user:{user_id}:links:order"
+
+def views_key(user_id: int) -> str:
+    return f"user:{user_id}:links:views"
+
+def ready_key(user_id: int) -> str:
+    return f"user:{user_id}:links:ready"
+
+def build_lock_key(user_id: int) -> str:
+    return f"user:{user_id}:links:building"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def created_us(created_at: Optional[datetime]) -> int:
+    if created_at is None:
+        return 0
+    # Stored timestamps are naive UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+def order_member(created_at: Optional[datetime], user_link_id: int) -> str:
+    return f"{created_us(created_at):016d}:{user_link_id:012d}"
+
+def parse_member(member: str) -> tuple[datetime, int]:
+    """
+    Inverse of order_member, returning naive UTC.
+    """
+    us, user_link_id = member.split(":", 1)
+    return (EPOCH + timedelta(microseconds=int(us))).replace(tzinfo=None), int(user_link_id)
+
+def view_member(view: dict) -> str:
+    created_at = datetime.fromisoformat(view["created_at"]) if view["created_at"] else None
+    return order_member(created_at, view["user_link_id"])
+
+# Mutations only touch a complete index; a missing one is rebuilt on the next read.
+# KEYS[1] = ready, KEYS[2] = order, KEYS[3] = views; ARGV = member, user_link_id, view JSON, ...
+UPSERT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 3 do
+    redis.call('ZADD', KEYS[2], 0, ARGV[i])
+    redis.call('HSET', KEYS[3], ARGV[i + 1], ARGV[i + 2])
+end
+return 1
+"""
+# KEYS as above; ARGV = member, user_link_id, ...
+REMOVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('ZREM', KEYS[2], ARGV[i])
+    redis.call('HDEL', KEYS[3], ARGV[i + 1])
+end
+return 1
+"""
+# Swaps a freshly built index in, unless the list changed while it was being built.
+# KEYS[1] = version, KEYS[2] = built order, KEYS[3] = built views, KEYS[4] = order,
+# KEYS[5] = views, KEYS[6] = ready; ARGV[1] = version seen before the build, ARGV[2] = TTL
+COMMIT_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    return 0
+end
+redis.call('DEL', KEYS[4], KEYS[5])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RENAME', KEYS[2], KEYS[4])
+    redis.call('RENAME', KEYS[3], KEYS[5])
+    redis.call('EXPIRE', KEYS[4], ARGV[2])
+    redis.call('EXPIRE', KEYS[5], ARGV[2])
+end
+redis.call('SET', KEYS[6], 1, 'EX', ARGV[2])
+return 1
+"""
+upsert_script = redis_client.register_script(UPSERT_SCRIPT)
+remove_script = redis_client.register_script(REMOVE_SCRIPT)
+commit_script = redis_client.register_script(COMMIT_SCRIPT)
+
+def _keys(user_id: int) -> list[str]:
+    return [ready_key(user_id), order_key(user_id), views_key(user_id)]
+
+def upsert_views(redis: Redis, user_id: int, views: Iterable[dict]) -> None:
+    args = []
+    for view in views:
+        args += [view_member(view), view["user_link_id"], json.dumps(view)]
+    if args:
+        upsert_script(keys=_keys(user_id), args=args, client=redis)
+
+def remove_views(redis: Redis, user_id: int, members: Iterable[tuple[Optional[datetime], int]]) -> None:
+    """
+    `members` are (link created_at, user_link_id) pairs.
+    """
+    args = []
+    for created_at, user_link_id in members:
+        args += [order_member(created_at, user_link_id), user_link_id]
+    if args:
+        remove_script(keys=_keys(user_id), args=args, client=redis)
+
+def read_page(redis: Redis, user_id: int, limit: int, after: Optional[str],
+              descending: bool) -> Optional[tuple[list[dict], Optional[str]]]:
+    """
+    Returns up to `limit` views following the `after` member and the member to continue from,
+    or None if the index is not built.
+    """
+    if descending:
+        start, end = (f"({after}" if after else "+"), "-"
+    else:
+        start, end = (f"({after}" if after else "-"), "+"
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(ready_key(user_id))
+    pipe.zrange(order_key(user_id), start, end, desc=descending, bylex=True, offset=0, num=limit + 1)
+    ready, members = pipe.execute()
+    if not ready:
+        return None
+
+    next_member = members[limit - 1] if len(members) > limit else None
+    members = members[:limit]
+    if not members:
+        return [], None
+    ids = [parse_member(member)[1] for member in members]
+    pipe = redis.pipeline(transaction=False)
+    pipe.hmget(views_key(user_id), ids)
+    for key in _keys(user_id):
+        pipe.expire(key, INDEX_TTL_SECONDS)
+    raw_views = pipe.execute()[0]
+    if any(raw is None for raw in raw_views):
+        # Index and views disagree (e.g. one expired first): force a rebuild
+        redis.delete(ready_key(user_id))
+        return None
+    return [json.loads(raw) for raw in raw_views], next_member
+
+def rebuild(redis: Redis, user_id: int, views: Iterable[dict], version_key: str) -> bool:
+    """
+    Build the user's index from `views`. Returns False if another build holds the lock
+    or the list changed meanwhile.
+    """
+    if not redis.set(build_lock_key(user_id), 1, nx=True, ex=BUILD_LOCK_SECONDS):
+        return False
+    build_id = uuid.uuid4().hex
+    tmp_order = f"{order_key(user_id)}:build:{build_id}"
+    tmp_views = f"{views_key(user_id)}:build:{build_id}"
+    try:
+        version = redis.get(version_key) or "0"
+        pipe = redis.pipeline(transaction=False)
+        queued = 0
+        for view in views:
+            pipe.zadd(tmp_order, {view_member(view): 0})
+            pipe.hset(tmp_views, view["user_link_id"], json.dumps(view))
+            queued += 1
+            if queued % BUILD_BATCH == 0:
+                pipe.expire(tmp_order, BUILD_LOCK_SECONDS)
+                pipe.expire(tmp_views, BUILD_LOCK_SECONDS)
+                pipe.execute()
+        pipe.expire(tmp_order, BUILD_LOCK_SECONDS)
+        pipe.expire(tmp_views, BUILD_LOCK_SECONDS)
+        pipe.execute()
+        return bool(commit_script(
+            keys=[version_key, tmp_order, tmp_views, *_keys(user_id)[1:], ready_key(user_id)],
+            args=[version, INDEX_TTL_SECONDS], client=redis,
+        ))
+    finally:
+        redis.delete(build_lock_key(user_id))